@@ -1,11 +1,18 @@
 from .base import *
+from .batch import *
+from .cache import *
 from .controller import *
 from .data import *
 from .fetsav import *
+from .frontier import *
 from .item import *
 from .log import *
+from .metrics import *
+from .parse import *
 from .processor import *
+from .profile import *
 from .reqrep import *
+from .retry import *
 from .spider import *
 
 
@@ -18,13 +25,20 @@ def get_all(*mods):
 
 __all__ = get_all(
     base,
+    batch,
+    cache,
     controller,
     data,
     fetsav,
+    frontier,
     item,
     log,
+    metrics,
+    parse,
     processor,
+    profile,
     reqrep,
+    retry,
     spider,
 )
 
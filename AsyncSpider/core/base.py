@@ -1,21 +1,29 @@
 from . import log
 from .data import FrozenDict
-from threading import Thread
+from threading import Thread, Lock
 from queue import Queue as ThreadSafeQueue
 from queue import Empty
 from asyncio import AbstractEventLoop
+from collections import deque
 from functools import partial
 from logging import Logger
 import concurrent.futures
 import asyncio
 import weakref
+import time
 
 __all__ = ['CallbackMixin',
            'AioExecutor', 'AioThreadExecutor',
+           'ThreadSafeSemaphore',
            'SuperProcessorMixin',
            'ControllerShortcutMixin']
 
 
+def _running_loop():
+    # the loop running in this thread, asyncio.get_running_loop is new in 3.7
+    return asyncio._get_running_loop()
+
+
 class CallbackMixin:
     def __init__(self):
         self._on_start_callback_queue = ThreadSafeQueue()
@@ -57,12 +65,18 @@ class CallbackMixin:
 
 
 class AioExecutor(CallbackMixin):
-    def __init__(self):
+    def __init__(self, loop: AbstractEventLoop = None):
         CallbackMixin.__init__(self)
-        self._loop = asyncio.new_event_loop()
+        # an attached executor shares a loop which is driven by its owner
+        self._is_attached = loop is not None
+        self._loop = asyncio.new_event_loop() if loop is None else loop
+        self._tasks = set()
+        self._stopped = self._loop.create_future() if self._is_attached else None
         self._is_initial = True
         self._is_running = False
         self._is_stopped = False
+        self._is_closed = False
+        self._on_closed_callback_queue = ThreadSafeQueue()
 
     @property
     def loop(self) -> AbstractEventLoop:
@@ -82,7 +96,11 @@ class AioExecutor(CallbackMixin):
 
     @property
     def is_closed(self):
-        return self._loop.is_closed()
+        return self._is_closed
+
+    @property
+    def is_attached(self):
+        return self._is_attached
 
     def _run(self):
         try:
@@ -96,14 +114,60 @@ class AioExecutor(CallbackMixin):
             self._exec_stop_callbacks()
         finally:
             self._loop.close()
+            self._set_closed()
+
+    def call_on_closed(self, func, *args, **kwargs):
+        # called when the executor is closed, by the thread which closes it
+        self._call(self._on_closed_callback_queue, func, *args, **kwargs)
+
+    def _set_closed(self):
+        self._is_closed = True
+        self._exec_all(self._on_closed_callback_queue)
+
+    def _own_tasks(self):
+        if self._is_attached:
+            return {t for t in self._tasks if not t.done()}
+        return asyncio.Task.all_tasks(loop=self._loop)
 
     def _clean_loop(self):
-        tasks = asyncio.Task.all_tasks(loop=self._loop)
+        tasks = self._own_tasks()
         for task in tasks:
             task.cancel()
         if tasks:
             self._loop.run_until_complete(asyncio.wait(tasks))
 
+    def _start_attached(self):
+        self._exec_start_callbacks()
+        self._is_initial, self._is_running = False, True
+
+    def _stop_attached(self):
+        # stop may be called by any thread, the loop's thread finishes it
+        self._is_running, self._is_stopped = False, True
+        if _running_loop() is self._loop:
+            self._on_stopped_attached()
+        else:
+            self._loop.call_soon_threadsafe(self._on_stopped_attached)
+
+    def _on_stopped_attached(self):
+        # tasks are cancelled here, but awaited in _close_attached
+        # because only the owner knows when the shared loop is idle
+        for task in list(self._tasks):
+            task.cancel()
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    async def wait_stopped(self):
+        assert self._is_attached
+        await asyncio.shield(self._stopped)
+
+    def _close_attached(self):
+        # must be called by the owner while the shared loop is not running
+        try:
+            self._clean_loop()
+            self._exec_stop_callbacks()
+        finally:
+            self._set_closed()
+
     def run(self):
         self._run()
 
@@ -119,7 +183,11 @@ class AioExecutor(CallbackMixin):
 
     def run_coro(self, coro) -> asyncio.Task:
         assert not self.is_stopped
-        return self._loop.create_task(coro)
+        task = self._loop.create_task(coro)
+        if self._is_attached:
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return task
 
     def run_coro_threadsafe(self, coro) -> concurrent.futures.Future:
         assert not self.is_stopped
@@ -127,34 +195,99 @@ class AioExecutor(CallbackMixin):
 
 
 class AioThreadExecutor(AioExecutor):
+    # runs its own loop in its own thread,
+    # or runs as a group of tasks on a shared loop if attached
+
     def run(self):
         self.start()
         self.join()
 
     @property
     def is_running(self):
-        return not self._is_stopped and self._thread.is_alive()
-
-    @property
-    def is_closed(self):
-        return not self._thread.is_alive() and not self._is_initial
-
-    def __init__(self):
-        AioExecutor.__init__(self)
-        self._thread = Thread(target=self._run)
+        if self._is_attached:
+            return self._is_running
+        return not self._is_stopping and not self._is_stopped and self._thread.is_alive()
+
+    def __init__(self, loop: AbstractEventLoop = None):
+        AioExecutor.__init__(self, loop)
+        self._thread = None if self._is_attached else Thread(target=self._run)
+        self._is_stopping = False  # stop has been called, the loop may still be cleaned
         self.call_on_start(asyncio.set_event_loop, self._loop)
 
     def start(self):
+        if self._is_attached:
+            assert self._is_initial
+            self._start_attached()
+            return
         assert not self._thread.is_alive()
         self._thread.start()
 
     def join(self):
+        assert not self._is_attached
         assert self._thread.is_alive()
         self._thread.join()
 
     def stop(self):
         assert self.is_running
-        self.call_soon_threadsafe(self._loop.stop)
+        if self._is_attached:
+            self._stop_attached()
+        else:
+            self.call_soon_threadsafe(self._loop.stop)
+            self._is_stopping = True
+
+
+class ThreadSafeSemaphore:
+    # a semaphore which can be acquired by coroutines on any loop and released from any thread
+    # waiters are woken in FIFO order
+
+    def __init__(self, value):
+        assert value >= 1
+        self._value = value
+        self._lock = Lock()
+        self._waiters = deque()
+        self.waiting = 0
+        self.wait_time = 0.0
+
+    async def acquire(self, loop: AbstractEventLoop):
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            fut = loop.create_future()
+            self._waiters.append((loop, fut))
+            self.waiting += 1
+
+        t0 = time.monotonic()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, fut))
+                except ValueError:
+                    pass
+            if fut.done() and not fut.cancelled():
+                # granted, but cancelled before resumed
+                self.release()
+            raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self.wait_time += time.monotonic() - t0
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._value += 1
+                return
+            loop, fut = self._waiters.popleft()
+        loop.call_soon_threadsafe(self._grant, fut)
+
+    def _grant(self, fut):
+        if fut.cancelled():
+            self.release()
+        else:
+            fut.set_result(None)
 
 
 class SuperProcessorMixin:
@@ -193,3 +326,11 @@ class ControllerShortcutMixin:
     @property
     def runtime_data(self) -> dict:
         return self._controller.runtime_data
+
+    @property
+    def metrics(self):
+        return self._controller.metrics
+
+    @property
+    def profiler(self):
+        return self._controller.profiler
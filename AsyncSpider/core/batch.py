@@ -0,0 +1,197 @@
+from .item import Item
+import csv
+import json
+
+__all__ = ['ItemBatch']
+
+_DTYPES = {int: 'int64', float: 'float64', bool: 'bool'}
+
+
+def _numpy():
+    # numpy is optional, and imported on first use
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _all_of_type(values, field_type) -> bool:
+    # numpy converts silently, e.g. 1.9 to 1 for int and 'no' to True for bool, so values are checked first
+    if field_type is int:
+        return all(isinstance(v, int) and not isinstance(v, bool) for v in values)
+    return all(isinstance(v, field_type) for v in values)
+
+
+def _to_list(column) -> list:
+    return column.tolist() if hasattr(column, 'tolist') else list(column)
+
+
+class ItemBatch:
+    # items of one Item subclass stored column by column, in the order of all_keys()
+    # with numpy, a column of Field(type=int/float/bool) whose values are all of that type is a typed array,
+    # and other columns are object arrays, so columns can be filtered and transformed without python loops
+    # without numpy, columns are lists
+    # None in a column means the key is not set
+    """ Usage:
+    batch = ItemBatch.from_items(items)
+    batch = batch.filter(batch['price'] > 100)
+    batch['price'] = batch['price'] * 0.9
+    batch.to_jsonl('items.jsonl')
+    """
+
+    def __init__(self, item_class, columns: dict = None):
+        assert issubclass(item_class, Item)
+        self._item_class = item_class
+        self._np = _numpy()
+        self._columns = {}
+        columns = columns or {}
+        self._len = len(next(iter(columns.values()))) if columns else 0
+        for key in item_class.all_keys():
+            self._set_column(key, columns.get(key))
+        for key in columns:
+            if key not in self._columns:
+                raise KeyError(key)
+
+    def _make_column(self, key, values):
+        np = self._np
+        if np is None:
+            return list(values)
+        if isinstance(values, np.ndarray):
+            return values
+        values = list(values)
+        field_type = self._item_class.fields[key].get('type')
+        dtype = _DTYPES.get(field_type)
+        if dtype is not None and _all_of_type(values, field_type):
+            try:
+                return np.array(values, dtype=dtype)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    def _set_column(self, key, values):
+        if values is None:
+            values = [None] * self._len
+        column = self._make_column(key, values)
+        if len(column) != self._len:
+            raise ValueError('column {!r} has {} values, expected {}'.format(key, len(column), self._len))
+        self._columns[key] = column
+
+    @classmethod
+    def from_items(cls, items, item_class=None) -> 'ItemBatch':
+        # item_class defaults to the class of the first item
+        items = list(items)
+        if item_class is None:
+            if not items:
+                raise ValueError('item_class is required for no items')
+            item_class = type(items[0])
+        keys = item_class.all_keys()
+        rows = [item.to_tuple() for item in items]
+        columns = dict(zip(keys, zip(*rows))) if rows else {key: () for key in keys}
+        return cls(item_class, columns)
+
+    @classmethod
+    def concat(cls, batches) -> 'ItemBatch':
+        batches = list(batches)
+        item_class = batches[0].item_class
+        columns = {}
+        for key in item_class.all_keys():
+            values = []
+            for b in batches:
+                assert b.item_class is item_class
+                values.extend(_to_list(b[key]))
+            columns[key] = values
+        return cls(item_class, columns)
+
+    @property
+    def item_class(self):
+        return self._item_class
+
+    def keys(self):
+        return self._item_class.all_keys()
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, key):
+        return self._columns[key]
+
+    def __setitem__(self, key, values):
+        if key not in self._columns:
+            raise KeyError(key)
+        self._set_column(key, values)
+
+    def __repr__(self):
+        return '<ItemBatch of {} {}>'.format(self._len, self._item_class.__name__)
+
+    def take(self, indices) -> 'ItemBatch':
+        # a new batch of the rows at indices
+        if self._np is not None:
+            indices = self._np.asarray(indices, dtype='int64')
+            return ItemBatch(self._item_class, {k: c[indices] for k, c in self._columns.items()})
+        indices = list(indices)
+        return ItemBatch(self._item_class, {k: [c[i] for i in indices] for k, c in self._columns.items()})
+
+    def filter(self, mask) -> 'ItemBatch':
+        # a new batch of the rows where mask is true,
+        # mask is a sequence of bools or a function which returns one from this batch
+        if callable(mask):
+            mask = mask(self)
+        if self._np is not None:
+            mask = self._np.asarray(mask, dtype=bool)
+            return ItemBatch(self._item_class, {k: c[mask] for k, c in self._columns.items()})
+        return self.take(i for i, m in enumerate(mask) if m)
+
+    def transform(self, key, func) -> 'ItemBatch':
+        # sets the column of key to func(column), returns self
+        self[key] = func(self._columns[key])
+        return self
+
+    def rows(self):
+        # tuples of values in the order of keys(), as python objects
+        return zip(*(_to_list(self._columns[k]) for k in self.keys()))
+
+    def to_items(self) -> list:
+        cls = self._item_class
+        keys = tuple(self.keys())
+        items = []
+        for row in self.rows():
+            item = cls()
+            for k, v in zip(keys, row):
+                if v is None:
+                    del item[k]
+                else:
+                    item[k] = v
+            items.append(item)
+        return items
+
+    def __iter__(self):
+        return iter(self.to_items())
+
+    def to_dicts(self) -> list:
+        keys = tuple(self.keys())
+        return [{k: v for k, v in zip(keys, row) if v is not None} for row in self.rows()]
+
+    def to_csv(self, file, header=True):
+        # file is a path or a text file object, None is written as an empty string
+        if isinstance(file, str):
+            with open(file, 'w', newline='', encoding='utf8') as f:
+                self.to_csv(f, header)
+            return
+        writer = csv.writer(file)
+        if header:
+            writer.writerow(self.keys())
+        writer.writerows(self.rows())
+
+    def to_jsonl(self, file):
+        # file is a path or a text file object, one json object of set keys per line
+        if isinstance(file, str):
+            with open(file, 'w', encoding='utf8') as f:
+                self.to_jsonl(f)
+            return
+        dumps = json.dumps
+        for d in self.to_dicts():
+            file.write(dumps(d, ensure_ascii=False, default=str))
+            file.write('\n')
@@ -0,0 +1,177 @@
+from .reqrep import Request, Response
+from collections import OrderedDict
+from multidict import CIMultiDict, CIMultiDictProxy
+import asyncio
+import os
+import pickle
+import time
+
+__all__ = ['HttpCache']
+
+
+class HttpCache:
+    # stores responses of GET requests on disk, keyed by request fingerprint
+    # fresh entries are served without requests, stale entries are revalidated
+    # with If-None-Match / If-Modified-Since if they have validators
+    # least recently used entries are evicted when the total size exceeds max_size
+    # Cache-Control: no-store of a request or a response is not stored, and no-cache is always revalidated
+    # the index of existing entries is read by the default executor on first use
+
+    def __init__(self, path, loop, ttl=3600, max_size=2 ** 30):
+        self._path = path
+        self._loop = loop
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._index = None  # key -> size, least recently used first
+        self._indexing = None  # future of _read_index
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _read_index(self):
+        # blocking, leftovers of interrupted writes are removed
+        files = []
+        for root, _, names in os.walk(self._path):
+            for name in names:
+                file = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    try:
+                        os.remove(file)
+                    except OSError:
+                        pass
+                    continue
+                st = os.stat(file)
+                files.append((st.st_mtime, name, st.st_size))
+        index = OrderedDict()
+        for _, key, size in sorted(files):
+            index[key] = size
+        return index
+
+    async def _load_index(self):
+        if self._index is not None:
+            return
+        if self._indexing is None:
+            self._indexing = self._loop.run_in_executor(None, self._read_index)
+        index = await asyncio.shield(self._indexing)
+        if self._index is None:
+            self._index = index
+            self._size = sum(index.values())
+
+    def _file(self, key):
+        return os.path.join(self._path, key[:2], key)
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def _write(self, key, data):
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, file)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    async def load(self, key) -> dict:
+        await self._load_index()
+        if key not in self._index:
+            return None
+        entry = await self._loop.run_in_executor(None, self._read, key)
+        if entry is None:
+            self._size -= self._index.pop(key, 0)
+        else:
+            self._index.move_to_end(key)
+        return entry
+
+    async def store(self, key, entry: dict):
+        await self._load_index()
+        data = pickle.dumps(entry)
+        await self._loop.run_in_executor(None, self._write, key, data)
+        self._size += len(data) - self._index.pop(key, 0)
+        self._index[key] = len(data)
+
+        evicted = []
+        while self._size > self.max_size and len(self._index) > 1:
+            old, size = self._index.popitem(last=False)
+            self._size -= size
+            evicted.append(old)
+        for old in evicted:
+            await self._loop.run_in_executor(None, self._remove, old)
+
+    @staticmethod
+    def _entry(resp: Response) -> dict:
+        return dict(time=time.time(), method=resp.method, url=resp.url, status=resp.status,
+                    content=resp.content, headers=list(resp.headers.items()),
+                    cookies=resp.cookies, host=resp.host)
+
+    @staticmethod
+    def _response(entry: dict) -> Response:
+        return Response(method=entry['method'], url=entry['url'], status=entry['status'],
+                        content=entry['content'], headers=CIMultiDictProxy(CIMultiDict(entry['headers'])),
+                        cookies=entry['cookies'], host=entry['host'], history=())
+
+    @staticmethod
+    def cacheable(request: Request) -> bool:
+        return request['method'].upper() == 'GET'
+
+    @staticmethod
+    def _cache_control(headers) -> set:
+        # directives of Cache-Control, lower case and without arguments
+        if not headers:
+            return set()
+        value = CIMultiDict(headers).get('Cache-Control', '')
+        return {d.split('=', 1)[0].strip().lower() for d in value.split(',') if d.strip()}
+
+    async def fetch(self, request: Request, send) -> Response:
+        # send(request) is awaited to get a response from the origin
+        key = request.fingerprint().hex()
+        asked = self._cache_control(request.get('headers'))
+        if 'no-store' in asked:
+            self.misses += 1
+            return await send(request)
+        entry = await self.load(key)
+        if entry is not None:
+            fresh = time.time() - entry['time'] < self.ttl
+            if fresh and 'no-cache' not in asked and 'no-cache' not in self._cache_control(entry['headers']):
+                self.hits += 1
+                return self._response(entry)
+
+            stored_headers = CIMultiDict(entry['headers'])
+            validators = {}
+            if 'ETag' in stored_headers:
+                validators['If-None-Match'] = stored_headers['ETag']
+            if 'Last-Modified' in stored_headers:
+                validators['If-Modified-Since'] = stored_headers['Last-Modified']
+            if validators:
+                headers = dict(request.get('headers') or {})
+                headers.update(validators)
+                request = Request(**request)
+                request['headers'] = headers
+
+        resp = await send(request)
+        if entry is not None and resp.status == 304:
+            self.revalidated += 1
+            entry['time'] = time.time()
+            await self.store(key, entry)
+            return self._response(entry)
+
+        self.misses += 1
+        if resp.status == 200 and 'no-store' not in self._cache_control(resp.headers):
+            await self.store(key, self._entry(resp))
+        return resp
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated,
+                'entries': len(self._index or ()), 'size': self._size}
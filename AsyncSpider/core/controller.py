@@ -2,39 +2,77 @@ from .base import CallbackMixin
 from .data import FrozenDict
 from .spider import Spider
 from .fetsav import Fetcher, Saver
+from .parse import ParsePool
+from .metrics import Metrics
+from .profile import Profiler
 from .processor import RequestProcessor, ItemProcessor
-from .log import logger
+from .log import logger, configure_logging
 from queue import Queue as ThreadSafeQueue
+from threading import Thread, Lock, Condition
 from logging import Logger
+import multiprocessing
+import asyncio
+import os
 import time
 
 __all__ = ['Controller']
 
 
 class Controller(CallbackMixin):
-    def __init__(self, name: str, settings: dict = None):
+    def __init__(self, name: str, settings: dict = None, single_loop: bool = False):
         CallbackMixin.__init__(self)
         assert name != 'AsyncSpider'
+        configure_logging()
         self._name = name
         self._logger = logger.getChild(self._name)
 
-        if settings is not None:
-            settings = FrozenDict(settings)
-        self._settings = settings
+        self._settings = FrozenDict(settings or {})
+        self._metrics = Metrics()
+        self._profiler = None
+        self._stop_metrics_writer = None
+
+        # in single loop mode, fetcher, saver and spiders run as tasks on this loop
+        # and the loop is driven by the thread which calls wait_all
+        self._loop = asyncio.new_event_loop() if single_loop else None
 
         self._fetcher = Fetcher(self)
         self._saver = Saver(self)
         self._spiders = set()
+        self._classes = []
+
+        self._parse_pool = None
+        self._parse_pool_lock = Lock()
 
         self._runtime_callback_queue = ThreadSafeQueue()
+        self._on_spiders_closed_callback_queue = ThreadSafeQueue()
+        # notified when a runtime callback is added or an executor is closed
+        self._condition = Condition()
+        self._fetcher.call_on_closed(self._notify)
+        self._saver.call_on_closed(self._notify)
 
         self.runtime_data = {}
         st, ed = _set_rt(self)
         self.call_on_start(st)
+        self.call_on_start(self._start_metrics_writer)
+        self.call_on_start(self._make_profiler)
+        self.call_on_stop(self._close_parse_pool)
+        self.call_on_stop(self._dump_profile)
+        self.call_on_stop(self._stop_metrics)
         self.call_on_stop(ed)
 
     def call(self, func, *args, **kwargs):
         self._call(self._runtime_callback_queue, func, *args, **kwargs)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._exec_runtime_callbacks)
+        self._notify()
+
+    def call_on_spiders_closed(self, func, *args, **kwargs):
+        # called by wait_all when all spiders are closed, before the fetcher and saver are stopped
+        self._call(self._on_spiders_closed_callback_queue, func, *args, **kwargs)
+
+    def _notify(self):
+        with self._condition:
+            self._condition.notify_all()
 
     def _exec_runtime_callbacks(self):
         self._exec_all(self._runtime_callback_queue)
@@ -52,16 +90,32 @@ class Controller(CallbackMixin):
             elif issubclass(cls, ItemProcessor):
                 self._saver.add_processor(cls(self._saver))
             elif issubclass(cls, Spider):
-                self._spiders.add(cls(self))
+                spd = cls(self)
+                spd.call_on_closed(self._notify)
+                self._spiders.add(spd)
             else:
                 self.logger.warning('construct got an unexpected class: {}'.format(cls))
+                continue
+            self._classes.append(cls)
 
-    def _wait_for(self, predicate):
+    def _wait_for(self, predicate, timeout=None) -> bool:
+        # runs runtime callbacks until predicate() is true, woken by _notify
+        # returns False if timeout seconds have passed
+        deadline = None if timeout is None else time.monotonic() + timeout
         while True:
-            time.sleep(0.1)
             self._exec_runtime_callbacks()
-            if predicate():
-                break
+            with self._condition:
+                if predicate():
+                    return True
+                if not self._runtime_callback_queue.empty():
+                    continue
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
 
     def are_all_spiders_closed(self):
         for spd in self._spiders:
@@ -77,10 +131,49 @@ class Controller(CallbackMixin):
         for spd in self._spiders:
             spd.start()
 
+    def _run_until_stopped(self, executors):
+        async def wait():
+            for ate in executors:
+                await ate.wait_stopped()
+
+        self._loop.run_until_complete(wait())
+        self._exec_runtime_callbacks()
+
+    def _close_loop(self):
+        try:
+            tasks = asyncio.Task.all_tasks(loop=self._loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self._loop.run_until_complete(asyncio.wait(tasks, loop=self._loop))
+        finally:
+            self._loop.close()
+
+    def _wait_all_attached(self):
+        self._run_until_stopped(self._spiders)
+        self._exec_all(self._on_spiders_closed_callback_queue)
+        for ate in (self.fetcher, self.saver):
+            if ate.is_running:
+                ate.stop()
+        self._run_until_stopped((self.fetcher, self.saver))
+
+        for spd in self._spiders:
+            spd._close_attached()
+        self.fetcher._close_attached()
+        self.saver._close_attached()
+        self._close_loop()
+        self._exec_stop_callbacks()
+
     def wait_all(self):
+        if self._loop is not None:
+            self._wait_all_attached()
+            return
+
         self._wait_for(self.are_all_spiders_closed)
-        self.fetcher.stop()
-        self.saver.stop()
+        self._exec_all(self._on_spiders_closed_callback_queue)
+        for ate in (self.fetcher, self.saver):
+            if ate.is_running:
+                ate.stop()
         self._wait_for(lambda: self.fetcher.is_closed and self.saver.is_closed)
         self._exec_stop_callbacks()
 
@@ -88,14 +181,102 @@ class Controller(CallbackMixin):
         self.start_all()
         self.wait_all()
 
-    def stop_all(self):
+    def run_all_processes(self, processes: int, strategy: str = 'shard', central_saver: bool = True):
+        # strategy 'shard': every process runs all spiders, spiders split their work by Spider.partition
+        # strategy 'spiders': spiders are distributed among processes
+        # central_saver: items are sent back and saved by this controller's saver,
+        # otherwise every process saves its items by its own item processors
+        assert processes >= 1
+        assert strategy in ('shard', 'spiders')
+
+        spider_classes = [cls for cls in self._classes if issubclass(cls, Spider)]
+        other_classes = [cls for cls in self._classes if not issubclass(cls, Spider)]
+        if strategy == 'spiders':
+            processes = max(1, min(processes, len(spider_classes)))
+            groups = [(spider_classes[i::processes], (0, 1)) for i in range(processes)]
+        else:
+            groups = [(spider_classes, (i, processes)) for i in range(processes)]
+
+        ctx = multiprocessing.get_context()
+        # bounded by save_limit, so that worker processes wait while the central saver is busy
+        queue = ctx.Queue(max(0, self._settings.get('save_limit', 0)) if central_saver else 0)
+        procs = [ctx.Process(target=_process_main,
+                             args=(self._name, self._settings, self._loop is not None,
+                                   other_classes + group, index, shard, queue, central_saver))
+                 for index, (group, shard) in enumerate(groups)]
+        results = {}
+
+        def read():
+            saver = self.saver
+            while True:
+                msg = queue.get()
+                if msg[0] == 'item':
+                    # waits while save_limit items are in flight, like spiders do
+                    saver.run_coro_threadsafe(saver.acquire(saver.loop)).result()
+                    # run_coro by the saver's thread, so that an attached saver drains it
+                    saver.call_soon_threadsafe(saver.run_coro, saver.save_released(msg[1]))
+                elif msg[0] == 'done':
+                    results[msg[1]] = msg[2]
+                else:
+                    break
+
+        def join():
+            for proc in procs:
+                proc.join()
+            queue.put(('end',))
+            reader.join()
+
+        # processes are started first, so that no thread is running while forking,
+        # start callbacks may start threads, e.g. the metrics writer
+        reader = Thread(target=read)
+        for proc in procs:
+            proc.start()
+        self._exec_start_callbacks()
+        if central_saver:
+            self.saver.start()
+        reader.start()
+
+        if central_saver and self._loop is not None:
+            self._loop.run_until_complete(self._loop.run_in_executor(None, join))
+        else:
+            join()
+
+        # every component merges the runtime data it writes, other data is only kept in 'shards'
+        mergers = [Fetcher, Saver, Profiler, ParsePool]
+        mergers.extend(cls for cls in self._classes if cls not in mergers)
+        for index, proc in enumerate(procs):
+            if index in results:
+                for cls in mergers:
+                    cls.merge_runtime_data(self.runtime_data, results[index])
+            else:
+                self.logger.warning('Process {} exited without runtime data, exitcode: {}'.format(
+                    index, proc.exitcode))
+        self.runtime_data['shards'] = {i: results[i] for i in sorted(results)}
+        self.runtime_data['process_runtime'] = [results.get(i, {}).get('runtime') for i in range(len(procs))]
+
+        if central_saver:
+            self.saver.stop()
+            if self._loop is not None:
+                self._run_until_stopped((self.saver,))
+                self.saver._close_attached()
+                self._close_loop()
+            else:
+                self._wait_for(lambda: self.saver.is_closed)
+        self._exec_stop_callbacks()
+
+    def stop_all(self, drain_timeout=None):
+        # items being saved are given drain_timeout seconds from now, and cancelled after it,
+        # None means settings['drain_timeout'], which is no limit by default
+        if drain_timeout is not None:
+            self._saver.set_drain_timeout(drain_timeout)
+
         def gen_ate():
+            yield from self._spiders
             yield self._fetcher
             yield self._saver
-            yield from self._spiders
 
         for ate in gen_ate():
-            if not ate.is_stopped:
+            if ate.is_running:
                 ate.stop()
 
     @property
@@ -106,6 +287,61 @@ class Controller(CallbackMixin):
     def logger(self) -> Logger:
         return self._logger
 
+    @property
+    def loop(self):
+        # the shared loop in single loop mode, otherwise None
+        return self._loop
+
+    @property
+    def parse_pool(self) -> ParsePool:
+        # created on first use
+        # settings:
+        #   parse_workers: None, number of processes, None means the number of cpus
+        with self._parse_pool_lock:
+            if self._parse_pool is None:
+                self._parse_pool = ParsePool(self.settings.get('parse_workers'))
+            return self._parse_pool
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    def _start_metrics_writer(self):
+        # settings:
+        #   metrics_path: None, prometheus text file written periodically, '{name}' is the controller name
+        #   metrics_interval: 10, seconds between writes
+        path = self.settings.get('metrics_path')
+        if path is not None:
+            path = path.format(name=self._name)
+            self._stop_metrics_writer = self._metrics.start_writer(path, self.settings.get('metrics_interval', 10))
+
+    def _stop_metrics(self):
+        if self._stop_metrics_writer is not None:
+            self._stop_metrics_writer()
+            self._stop_metrics_writer = None
+
+    @property
+    def profiler(self) -> Profiler:
+        # None unless settings['profile'] is true
+        return self._profiler
+
+    def _make_profiler(self):
+        # settings:
+        #   profile: False, profile actions, request processors and item processors
+        #   profile_threshold: 1.0, runs slower than this are logged
+        if self.settings.get('profile', False):
+            self._profiler = Profiler(self.logger, self.settings.get('profile_threshold', 1.0))
+
+    def _dump_profile(self):
+        if self._profiler is not None:
+            self._profiler.dump()
+            self.runtime_data['profile'] = self._profiler.stats()
+
+    def _close_parse_pool(self):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self.runtime_data['parse_pool'] = self._parse_pool.stats()
+
     @property
     def settings(self) -> FrozenDict:
         return self._settings
@@ -123,6 +359,39 @@ class Controller(CallbackMixin):
         return tuple(self._spiders)
 
 
+class _ForwardIP(ItemProcessor):
+    # sends items from a worker process back to the main process
+    def __init__(self, saver, queue):
+        super().__init__(saver)
+        self._queue = queue
+
+    async def process(self, item):
+        # the queue may be full, put by a thread so that the loop is not blocked
+        await self.saver.loop.run_in_executor(None, self._queue.put, ('item', item))
+
+
+def _process_main(name, settings, single_loop, classes, index, shard, queue, central_saver):
+    settings = dict(settings or {})
+    settings['shard'] = shard
+    settings['process'] = index
+    # every process keeps its own cache index and size, so they must not share a directory
+    cache = settings.get('http_cache')
+    if cache is not None and '{shard}' not in cache:
+        settings['http_cache'] = os.path.join(cache, '{shard}')
+    ctrl = Controller('{}.{}'.format(name, index), settings, single_loop=single_loop)
+    try:
+        if central_saver:
+            ctrl.construct(*(cls for cls in classes if not issubclass(cls, ItemProcessor)))
+            ctrl.saver.add_processor(_ForwardIP(ctrl.saver, queue))
+        else:
+            ctrl.construct(*classes)
+        ctrl.run_all()
+    except Exception:
+        ctrl.logger.exception('Process {} failed.'.format(index))
+    finally:
+        queue.put(('done', index, ctrl.runtime_data))
+
+
 def _set_rt(ctrl):
     t0 = 0
     t1 = 0
@@ -1,7 +1,24 @@
 from abc import ABCMeta
-from collections import Mapping, MutableMapping, KeysView
+from collections.abc import Mapping, MutableMapping, KeysView
+import hashlib
+import math
 
-__all__ = ['DefinedKeysDictMeta', 'DefinedKeysDict', 'FrozenDict']
+__all__ = ['DefinedKeysDictMeta', 'DefinedKeysDict', 'FrozenDict', 'BloomFilter', 'sum_counters']
+
+_unset = object()  # value of keys which are not set
+
+
+def sum_counters(dst: dict, src: dict):
+    # adds the numbers of src to dst, recursively in dicts, other values are left alone
+    # used to merge the runtime data of worker processes, so src must hold counters only
+    for key, value in src.items():
+        if isinstance(value, dict):
+            old = dst.get(key)
+            if not isinstance(old, dict):
+                old = dst[key] = {}
+            sum_counters(old, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            dst[key] = dst.get(key, 0) + value
 
 
 class DefinedKeysDictMeta(ABCMeta):
@@ -10,78 +27,113 @@ class DefinedKeysDictMeta(ABCMeta):
         keys = getattr(cls, '_keys')
         setattr(cls, '_key_num', len(keys))
         setattr(cls, '_key2index', {k: i for i, k in enumerate(keys)})
+        # initial values of a new instance, subclasses may fill in defaults
+        setattr(cls, '_defaults', (_unset,) * len(keys))
 
 
 class DefinedKeysDict(MutableMapping, metaclass=DefinedKeysDictMeta):
     # has defined keys
     # keys and values are ordered
+    # values are kept in a list, indexed by _key2index
 
     __slots__ = ('_values',)
-    __marker = object()
 
     _keys = ()  # subclass must define this
     _key_num = 0
     _key2index = {}
+    _defaults = ()
 
     def __init__(self, **kwargs):
-        self._values = [self.__marker] * self._key_num
-        for key, value in kwargs.items():
-            if key not in self._keys:
-                raise KeyError(key)
-            self._values[self._key2index[key]] = value
+        values = list(self._defaults)
+        if kwargs:
+            key2index = self._key2index
+            for key, value in kwargs.items():
+                values[key2index[key]] = value
+        self._values = values
 
     def __getitem__(self, key):
-        if key not in self._keys:
-            raise KeyError(key)
         v = self._values[self._key2index[key]]
-        if v is self.__marker:
+        if v is _unset:
             raise KeyError(key)
         return v
 
     def __setitem__(self, key, value):
-        if key not in self._keys:
-            raise KeyError(key)
         self._values[self._key2index[key]] = value
 
     def __delitem__(self, key):
-        if key not in self._keys:
-            raise KeyError(key)
-        self._values[self._key2index[key]] = self.__marker
+        self._values[self._key2index[key]] = _unset
+
+    def __contains__(self, key):
+        i = self._key2index.get(key)
+        return i is not None and self._values[i] is not _unset
+
+    def get(self, key, default=None):
+        i = self._key2index.get(key)
+        if i is None:
+            return default
+        v = self._values[i]
+        return default if v is _unset else v
 
     def __iter__(self):
-        for i in range(self._key_num):
-            if self._values[i] is not self.__marker:
-                yield self._keys[i]
+        for k, v in zip(self._keys, self._values):
+            if v is not _unset:
+                yield k
 
     def __len__(self):
-        return self._key_num
+        # number of set keys
+        n = 0
+        for v in self._values:
+            if v is not _unset:
+                n += 1
+        return n
 
     def __str__(self):
         return '{' + ', '.join(('{!r}: {!r}'.format(k, v) for k, v in self.items())) + '}'
 
-    def pop(self, key, default=__marker):
-        try:
-            v = self[key]
-        except KeyError:
-            if default is self.__marker:
-                raise
+    def pop(self, key, default=_unset):
+        i = self._key2index.get(key)
+        v = _unset if i is None else self._values[i]
+        if v is _unset:
+            if default is _unset:
+                raise KeyError(key)
             return default
-        else:
-            del self[key]
-            return v
+        self._values[i] = _unset
+        return v
 
     def clear(self):
-        for i in range(self._key_num):
-            self._values[i] = self.__marker
+        self._values = [_unset] * self._key_num
 
     def copy(self):
-        return self.__class__(**self)
+        # a shallow copy
+        obj = self.__class__.__new__(self.__class__)
+        obj._values = self._values[:]
+        return obj
+
+    def to_dict(self) -> dict:
+        # set keys only
+        return {k: v for k, v in zip(self._keys, self._values) if v is not _unset}
+
+    def to_tuple(self, default=None) -> tuple:
+        # values of all keys in the order of all_keys(), unset keys are default
+        return tuple(default if v is _unset else v for v in self._values)
+
+    def __reduce__(self):
+        # the marker of unset keys can not be pickled, only set keys are kept
+        return _rebuild, (self.__class__, tuple(self.items()))
 
     @classmethod
     def all_keys(cls):
         return KeysView(cls._keys)
 
 
+def _rebuild(cls, items):
+    # unset keys stay unset, even if they have defaults
+    obj = cls.__new__(cls)
+    obj._values = [_unset] * cls._key_num
+    obj.update(items)
+    return obj
+
+
 class FrozenDict(Mapping):
     # https://stackoverflow.com/questions/2703599/what-would-a-frozen-dict-be
     def __init__(self, *args, **kwargs):
@@ -108,3 +160,60 @@ class FrozenDict(Mapping):
             for pair in self.items():
                 self._hash ^= hash(pair)
         return self._hash
+
+
+class BloomFilter:
+    # set of bytes with bounded memory and false positives, no false negatives
+    # memory: about 1.44 * log2(1 / error_rate) bits per key, e.g. 1.8 MB per million keys at 0.1%
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        assert capacity > 0 and 0 < error_rate < 1
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bit_num = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_num = max(1, int(round(self._bit_num / capacity * math.log(2))))
+        self._bits = bytearray((self._bit_num + 7) // 8)
+        self._len = 0
+
+    def _positions(self, key: bytes):
+        # double hashing: h1 + i * h2
+        d = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], 'little')
+        h2 = int.from_bytes(d[8:], 'little') | 1
+        m = self._bit_num
+        return [(h1 + i * h2) % m for i in range(self._hash_num)]
+
+    def __contains__(self, key: bytes):
+        bits = self._bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key: bytes):
+        bits = self._bits
+        new = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self._len += 1
+
+    def __len__(self):
+        # number of keys which were new when added, keys taken as false positives are not counted
+        return self._len
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def error_rate(self):
+        return self._error_rate
+
+    @property
+    def size(self):
+        # bytes of the bit array
+        return len(self._bits)
@@ -1,10 +1,21 @@
-from .base import AioThreadExecutor, SuperProcessorMixin, ControllerShortcutMixin
-from .reqrep import Request, Response
+from .base import AioThreadExecutor, ThreadSafeSemaphore, SuperProcessorMixin, ControllerShortcutMixin
+from .data import sum_counters
+from .reqrep import Request, Response, StreamResponse
+from .cache import HttpCache
+from .retry import RetryPolicy, CircuitBreaker
+from ..exceptions import DropItem, RequestFailError, CircuitOpenError
+from urllib.parse import urlsplit
+from collections import deque
 import asyncio
 import aiohttp
+import ssl
+import time
 
 __all__ = ['Fetcher', 'Saver']
 
+# pool_stats reads private fields of aiohttp's connector, which are known for aiohttp 3
+_POOL_STATS = getattr(aiohttp, '__version__', '').split('.')[0] == '3'
+
 
 def activate_all(sp):
     for p in sp.processors:
@@ -24,25 +35,400 @@ class Fetcher(AioThreadExecutor, SuperProcessorMixin, ControllerShortcutMixin):
     def __init__(self, controller):
         ControllerShortcutMixin.__init__(self, controller)
         SuperProcessorMixin.__init__(self)
-        AioThreadExecutor.__init__(self)
+        AioThreadExecutor.__init__(self, controller.loop)
         self._session: aiohttp.ClientSession = None
+        self._cache: HttpCache = None
+        self._retry: RetryPolicy = None
+        self._breaker: CircuitBreaker = None
+        self.retries = 0
+        self.gave_up = 0
+        self._timeout: aiohttp.ClientTimeout = None
+        self._latencies = {}  # host -> deque of recent GET latencies, for hedge_percentile
+        self.hedge_eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
 
         def set_session():
-            self._session = aiohttp.ClientSession(loop=self._loop)
+            # settings:
+            #   timeout: 300, seconds of a whole request
+            #   connect_timeout: None, seconds to connect to the server, None means no limit
+            #   first_byte_timeout: None, seconds to wait for each read of the response,
+            #       which bounds the wait for the first byte, None means no limit
+            settings = self.settings
+            self._timeout = aiohttp.ClientTimeout(total=settings.get('timeout', 300),
+                                                  sock_connect=settings.get('connect_timeout'),
+                                                  sock_read=settings.get('first_byte_timeout'))
+            self._session = aiohttp.ClientSession(connector=self._make_connector(), timeout=self._timeout,
+                                                  loop=self._loop)
+
+        def set_hedge():
+            # settings:
+            #   hedge_delay: None, seconds before a second attempt of a GET is sent, None means no hedging
+            #   hedge_percentile: None, e.g. 0.95, the delay is this percentile of recent latencies of the host,
+            #       hedge_delay is used until hedge_min_samples are recorded
+            #   hedge_min_samples: 20, hedge_window: 200, latencies kept per host
+            #   hedge_budget: 0.1, max fraction of GETs which are hedged
+            settings = self.settings
+            self._hedge_delay = settings.get('hedge_delay')
+            self._hedge_percentile = settings.get('hedge_percentile')
+            self._hedge_min_samples = settings.get('hedge_min_samples', 20)
+            self._hedge_window = settings.get('hedge_window', 200)
+            self._hedge_budget = settings.get('hedge_budget', 0.1)
+
+        def set_cache():
+            # settings:
+            #   http_cache: None, directory of the cache, None means no cache,
+            #       '{shard}' is the index of the worker process of Controller.run_all_processes, 0 otherwise
+            #   http_cache_ttl: 3600, seconds before an entry is revalidated
+            #   http_cache_size: 2 ** 30, max bytes of the cache
+            path = self.settings.get('http_cache')
+            if path is not None:
+                path = path.format(shard=self.settings.get('process', 0))
+                self._cache = HttpCache(path, self._loop,
+                                        ttl=self.settings.get('http_cache_ttl', 3600),
+                                        max_size=self.settings.get('http_cache_size', 2 ** 30))
+
+        def set_retry():
+            # settings:
+            #   retry_times: 0, max retries of a request of retry_methods by fetch, 0 means no retry
+            #   retry_statuses: (408, 429, 500, 502, 503, 504)
+            #   retry_exceptions: (aiohttp.ClientError, asyncio.TimeoutError)
+            #   retry_methods: ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+            #   retry_backoff: 0.5, retry_backoff_max: 30.0, seconds, see RetryPolicy
+            #   breaker_threshold: 0, failed requests in a row which open a host, 0 means no breaker
+            #   breaker_cooldown: 30.0, seconds a host stays open
+            settings = self.settings
+            self._retry = RetryPolicy(
+                times=settings.get('retry_times', 0),
+                statuses=settings.get('retry_statuses', (408, 429, 500, 502, 503, 504)),
+                exceptions=settings.get('retry_exceptions', (aiohttp.ClientError, asyncio.TimeoutError)),
+                methods=settings.get('retry_methods', ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')),
+                backoff=settings.get('retry_backoff', 0.5),
+                backoff_max=settings.get('retry_backoff_max', 30.0))
+            threshold = settings.get('breaker_threshold', 0)
+            if threshold > 0:
+                self._breaker = CircuitBreaker(threshold, settings.get('breaker_cooldown', 30.0))
 
         def close_session():
             self._loop.run_until_complete(self._session.close())
+            if self._cache is not None:
+                self.runtime_data['http_cache'] = self._cache.stats()
+            self.runtime_data['retry'] = self.retry_stats()
+            self.runtime_data['hedge'] = self.hedge_stats()
 
         self.call_on_start(set_session)
+        self.call_on_start(set_cache)
+        self.call_on_start(set_retry)
+        self.call_on_start(set_hedge)
         self.call_on_stop(close_session)
         self.call_on_start(activate_all, self)
+        self._pool_stats = {}  # read by the last _refresh_pool_stats
+        self.metrics.add_collector(self._collect_pool_stats)
+
+    def _make_connector(self):
+        settings = self.settings
+        if settings.get('ssl_verify', True):
+            # one context for all connections, instead of one per host
+            ssl_context = ssl.create_default_context()
+        else:
+            ssl_context = False
+        return aiohttp.TCPConnector(limit=settings.get('conn_limit', 100),
+                                    limit_per_host=settings.get('conn_limit_per_host', 0),
+                                    keepalive_timeout=settings.get('keepalive_timeout', 15),
+                                    ttl_dns_cache=settings.get('dns_cache_ttl', 10),
+                                    ssl=ssl_context,
+                                    loop=self._loop)
+
+    async def pool_stats(self) -> dict:
+        # {host: {'open': n, 'idle': n, 'waiting': n}}, {} for other versions of aiohttp than 3
+        # a coroutine, so that it runs in the fetcher's loop, e.g. by run_coro_threadsafe
+        if not _POOL_STATS or self._session is None:
+            return {}
+        connector = self._session.connector
+        stats = {}
+
+        def stat(key):
+            host = '{}:{}'.format(*_host_port(key))
+            return stats.setdefault(host, {'open': 0, 'idle': 0, 'waiting': 0})
+
+        for key, conns in list(connector._conns.items()):
+            st = stat(key)
+            st['idle'] += len(conns)
+            st['open'] += len(conns)
+        for key, conns in list(getattr(connector, '_acquired_per_host', {}).items()):
+            stat(key)['open'] += len(conns)
+        for key, waiters in list(getattr(connector, '_waiters', {}).items()):
+            stat(key)['waiting'] += len(waiters)
+        return stats
+
+    async def _refresh_pool_stats(self):
+        stats = await self.pool_stats()
+        # hosts which are gone are reported as 0 instead of keeping their last values
+        for host in self._pool_stats:
+            stats.setdefault(host, {'open': 0, 'idle': 0, 'waiting': 0})
+        self._pool_stats = stats
+
+    def _collect_pool_stats(self, metrics):
+        # called by any thread, sets the stats read last time and reads them again in the fetcher's loop
+        for host, st in list(self._pool_stats.items()):
+            for key, value in st.items():
+                metrics.set('fetch_pool_' + key, value, host=host)
+        if _POOL_STATS and self.is_running:
+            try:
+                self.run_coro_threadsafe(self._refresh_pool_stats())
+            except (AssertionError, RuntimeError):
+                pass  # stopped meanwhile
 
-    async def fetch(self, method, url, **kwargs):
+    def _request_timeout(self, timeout, connect_timeout, first_byte_timeout) -> aiohttp.ClientTimeout:
+        # the session's timeout with the given deadlines replaced
+        d = self._timeout
+        return aiohttp.ClientTimeout(total=d.total if timeout is None else timeout,
+                                     connect=d.connect,
+                                     sock_connect=d.sock_connect if connect_timeout is None else connect_timeout,
+                                     sock_read=d.sock_read if first_byte_timeout is None else first_byte_timeout)
+
+    async def _prepare(self, method, url, connect_timeout=None, first_byte_timeout=None, **kwargs) -> Request:
+        # timeout, connect_timeout and first_byte_timeout override the settings for this request
+        timeout = kwargs.get('timeout')
+        if connect_timeout is not None or first_byte_timeout is not None or isinstance(timeout, (int, float)):
+            kwargs['timeout'] = self._request_timeout(timeout, connect_timeout, first_byte_timeout)
         req = Request(method, url, **kwargs)
-        for p in self._processors:
-            await p.process(req)
-        async with self._session.request(method, url, **kwargs) as resp:
-            return await Response.from_client_response(resp)
+        await self._process(req, self._processors)
+        return req
+
+    async def _prepare_resend(self, req: Request) -> Request:
+        # a copy of req for a retry or a hedge, processed again by processors with resend
+        req = Request(**req)
+        await self._process(req, [p for p in self._processors if p.resend])
+        return req
+
+    async def _process(self, req, processors):
+        profiler = self.profiler
+        for p in processors:
+            if profiler is None:
+                await p.process(req)
+            else:
+                record = profiler.start()
+                try:
+                    await profiler.step(p.process(req), record)
+                finally:
+                    profiler.finish(type(p).__name__, record)
+
+    @property
+    def cache(self) -> HttpCache:
+        return self._cache
+
+    def retry_stats(self) -> dict:
+        return {'retries': self.retries, 'gave_up': self.gave_up,
+                'breaker': self._breaker.stats() if self._breaker is not None else None}
+
+    def _check_breaker(self, host):
+        if self._breaker is not None and not self._breaker.allow(host):
+            self.metrics.inc('breaker_rejected_total', host=host)
+            raise CircuitOpenError('circuit of {} is open'.format(host))
+
+    def _record(self, host, ok):
+        if self._breaker is not None:
+            if ok:
+                self._breaker.success(host)
+            else:
+                self._breaker.failure(host)
+
+    async def _send_retrying(self, req: Request) -> Response:
+        # retries on retry_statuses and retry_exceptions with jittered exponential backoff, or Retry-After,
+        # every retry goes through the processors with resend, e.g. rate limiters
+        # when retries are used up, the last response is returned, or RequestFailError is raised
+        # the breaker counts one success or failure per request, not per attempt,
+        # and is checked before the first attempt, so the retries of a half open host's probe are sent
+        host = _hostname(req)
+        policy = self._retry
+        retries = policy.times if policy.allows(req['method']) else 0
+        retry = 0
+        attempt = req
+        self._check_breaker(host)
+        while True:
+            delay = None
+            try:
+                resp = await self._send_hedged(attempt)
+            except policy.exceptions as exc:
+                if retry >= retries:
+                    self._record(host, False)
+                    if not retry:
+                        raise
+                    self.gave_up += 1
+                    raise RequestFailError('{} {} failed after {} retries: {!r}'.format(
+                        req['method'], req['url'], retry, exc)) from exc
+                reason = type(exc).__name__
+            else:
+                if resp.status not in policy.statuses:
+                    self._record(host, True)
+                    return resp
+                delay = policy.retry_after(resp.status, resp.headers)
+                if retry >= retries or (delay is not None and delay > policy.backoff_max):
+                    # a longer Retry-After is not waited for
+                    self._record(host, False)
+                    if retry:
+                        self.gave_up += 1
+                    return resp
+                reason = str(resp.status)
+            retry += 1
+            self.retries += 1
+            self.metrics.inc('fetch_retries_total', host=host, reason=reason)
+            await asyncio.sleep(policy.delay(retry) if delay is None else delay, loop=self._loop)
+            attempt = await self._prepare_resend(req)
+
+    def hedge_stats(self) -> dict:
+        # win_rate is the fraction of hedged requests answered first by the second attempt
+        return {'eligible': self.hedge_eligible, 'hedged': self.hedged, 'wins': self.hedge_wins,
+                'win_rate': round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0}
+
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # merges the fetcher's runtime data of a worker process, src, into dst
+        # every process has its own cache directory, so its entries and size are summed too
+        if 'http_cache' in src:
+            sum_counters(dst.setdefault('http_cache', {}), src['http_cache'])
+        retry = src.get('retry')
+        if retry is not None:
+            merged = dst.setdefault('retry', {'retries': 0, 'gave_up': 0, 'breaker': None})
+            sum_counters(merged, retry)
+            breaker = retry.get('breaker')
+            if breaker is not None:
+                for key in ('open_hosts', 'half_open'):
+                    merged['breaker'][key] = sorted(set(merged['breaker'].get(key, ())) | set(breaker[key]))
+        hedge = src.get('hedge')
+        if hedge is not None:
+            merged = dst.setdefault('hedge', {})
+            sum_counters(merged, {k: v for k, v in hedge.items() if k != 'win_rate'})
+            merged['win_rate'] = round(merged['wins'] / merged['hedged'], 4) if merged['hedged'] else 0.0
+
+    def _hedge_after(self, req, host):
+        # seconds before a second attempt of req, None means no hedging
+        if req['method'].upper() != 'GET' or (self._hedge_delay is None and self._hedge_percentile is None):
+            return None
+        self.hedge_eligible += 1
+        if self.hedged >= self._hedge_budget * self.hedge_eligible:
+            return None
+        window = self._latencies.get(host)
+        if self._hedge_percentile is not None and window is not None and len(window) >= self._hedge_min_samples:
+            values = sorted(window)
+            return values[min(len(values) - 1, int(self._hedge_percentile * len(values)))]
+        return self._hedge_delay
+
+    async def _send_hedged(self, req: Request) -> Response:
+        # sends a second attempt if the first has not finished in time, and keeps the first success
+        # the second attempt goes through the processors with resend, the loser is cancelled and awaited
+        host = _hostname(req)
+        delay = self._hedge_after(req, host)
+        if delay is None:
+            return await self._send(req)
+        first = asyncio.ensure_future(self._send(req), loop=self._loop)
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay, loop=self._loop)
+            if not done:
+                self.hedged += 1
+                self.metrics.inc('fetch_hedges_total', host=host)
+                tasks.append(asyncio.ensure_future(self._send_resent(req), loop=self._loop))
+            while True:
+                done, _ = await asyncio.wait(tasks, loop=self._loop, return_when=asyncio.FIRST_COMPLETED)
+                # every exception is retrieved, not only the first
+                failed = [t for t in done if t.exception() is not None]
+                winner = next((t for t in done if t not in failed), None)
+                for t in done:
+                    tasks.remove(t)
+                if winner is not None or not tasks:
+                    break
+        finally:
+            for t in tasks:
+                t.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, loop=self._loop, return_exceptions=True)
+        if winner is None:
+            return done.pop().result()
+        if winner is not first:
+            self.hedge_wins += 1
+            self.metrics.inc('fetch_hedge_wins_total', host=host)
+        return winner.result()
+
+    async def _send_resent(self, req: Request) -> Response:
+        return await self._send(await self._prepare_resend(req))
+
+    def _observe(self, req, status, t0, size=0):
+        # latency by host and status, and bytes downloaded by host
+        host = _hostname(req)
+        self.metrics.observe('fetch_latency_seconds', self._loop.time() - t0, host=host, status=status)
+        if size:
+            self.metrics.inc('fetch_bytes_total', size, host=host)
+
+    async def _send(self, req: Request) -> Response:
+        t0 = self._loop.time()
+        try:
+            async with self._session.request(**req) as resp:
+                r = await Response.from_client_response(resp)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._observe(req, 'error', t0)
+            raise
+        self._observe(req, r.status, t0, len(r.content))
+        if self._hedge_percentile is not None and req['method'].upper() == 'GET':
+            host = _hostname(req)
+            window = self._latencies.get(host)
+            if window is None:
+                window = self._latencies[host] = deque(maxlen=self._hedge_window)
+            window.append(self._loop.time() - t0)
+        return r
+
+    async def fetch(self, method, url, **kwargs) -> Response:
+        req = await self._prepare(method, url, **kwargs)
+        if self._cache is not None and self._cache.cacheable(req):
+            return await self._cache.fetch(req, self._send_retrying)
+        return await self._send_retrying(req)
+
+    async def fetch_stream(self, method, url, **kwargs) -> StreamResponse:
+        # the body is not read, the caller must release the response
+        req = await self._prepare(method, url, **kwargs)
+        self._check_breaker(_hostname(req))
+        t0 = self._loop.time()
+        resp = await self._session.request(**req)
+        # latency of headers, the body is not counted
+        self._observe(req, resp.status, t0)
+        return StreamResponse.from_client_response(resp)
+
+    async def fetch_to(self, method, url, sink, chunk_size=2 ** 16, **kwargs) -> Response:
+        # writes the body to sink, a path or a binary file object, chunk by chunk
+        # writes run in the default executor, the returned response has no content
+        req = await self._prepare(method, url, **kwargs)
+        self._check_breaker(_hostname(req))
+        t0 = self._loop.time()
+        size = 0
+        async with self._session.request(**req) as resp:
+            is_path = isinstance(sink, str)
+            f = await self._loop.run_in_executor(None, open, sink, 'wb') if is_path else sink
+            try:
+                while True:
+                    chunk = await resp.content.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    await self._loop.run_in_executor(None, f.write, chunk)
+            finally:
+                if is_path:
+                    f.close()
+            self._observe(req, resp.status, t0, size)
+            return await Response.from_client_response(resp, read=False)
+
+
+def _hostname(req):
+    return urlsplit(str(req['url'])).hostname
+
+
+def _host_port(key):
+    # aiohttp uses ConnectionKey since 3.0, and tuple before
+    if hasattr(key, 'host'):
+        return key.host, key.port
+    return key[0], key[1]
 
 
 class Saver(AioThreadExecutor, SuperProcessorMixin, ControllerShortcutMixin):
@@ -55,16 +441,347 @@ class Saver(AioThreadExecutor, SuperProcessorMixin, ControllerShortcutMixin):
         SuperProcessorMixin.remove_processor(self, item_processor)
 
     def _clean_loop(self):
-        tasks = asyncio.Task.all_tasks(loop=self._loop)
+        # let pending saves go through the pipeline until the drain deadline,
+        # then cancel the rest and stop the stage workers
+        for stage in self._stages:
+            stage.close()
+        tasks = self._own_tasks() - self._stage_tasks
         if tasks:
-            self._loop.run_until_complete(asyncio.wait(tasks))
+            drained = asyncio.ensure_future(asyncio.wait(tasks), loop=self._loop)
+            while not drained.done():
+                # set_drain_timeout wakes this up to read the new deadline
+                self._drain_changed = self._loop.create_future()
+                timeout = self._drain_timeout()
+                if timeout is not None and timeout <= 0:
+                    break
+                self._loop.run_until_complete(asyncio.wait([drained, self._drain_changed], timeout=timeout,
+                                                           return_when=asyncio.FIRST_COMPLETED))
+                if not self._drain_changed.done():
+                    break
+            self._drain_changed = None
+            pending = {task for task in tasks if not task.done()}
+            if pending:
+                self.logger.warning('{} saves not finished by the drain deadline are cancelled.'.format(
+                    len(pending)))
+                self._cancelled = len(pending)
+                for task in pending:
+                    task.cancel()
+            self._loop.run_until_complete(drained)
+        for task in self._stage_tasks:
+            task.cancel()
+        if self._stage_tasks:
+            self._loop.run_until_complete(asyncio.wait(self._stage_tasks))
+
+    def _on_stopped_attached(self):
+        # pending saves are not cancelled, they are drained in _clean_loop
+        if not self._stopped.done():
+            self._stopped.set_result(None)
 
     def __init__(self, controller):
         ControllerShortcutMixin.__init__(self, controller)
         SuperProcessorMixin.__init__(self)
-        AioThreadExecutor.__init__(self)
+        AioThreadExecutor.__init__(self, controller.loop)
+        self._stages = []
+        self._stage_tasks = set()
+        self._inflight = 0
+        self._slots = None
+        self._drain_deadline = None
+        self._drain_changed = None
+        self._cancelled = 0
+
         self.call_on_start(activate_all, self)
+        self.call_on_start(self._make_stages)
+        self.call_on_start(self._make_slots)
+        self.call_on_stop(self._record_stats)
+        self.metrics.add_collector(self._collect_metrics)
+
+    def set_drain_timeout(self, timeout):
+        # pending saves are cancelled if not finished in timeout seconds from now, None means no limit
+        self._drain_deadline = float('inf') if timeout is None else time.monotonic() + timeout
+        fut = self._drain_changed
+        if fut is not None:
+            self._loop.call_soon_threadsafe(_resolve, fut)
+
+    def _drain_timeout(self):
+        # settings:
+        #   drain_timeout: None, seconds given to pending saves when the saver stops, None means no limit
+        if self._drain_deadline == float('inf'):
+            return None
+        if self._drain_deadline is not None:
+            return max(0.0, self._drain_deadline - time.monotonic())
+        return self.settings.get('drain_timeout')
+
+    def _make_slots(self):
+        # settings:
+        #   save_limit: 0, max number of items in flight from spiders, 0 means no limit
+        limit = self.settings.get('save_limit', 0)
+        if limit > 0:
+            self._slots = ThreadSafeSemaphore(limit)
+
+    def _make_stages(self):
+        # one stage per item processor, in the order of processors
+        next_stage = None
+        for p in reversed(self._processors):
+            next_stage = _Stage(self, p, next_stage)
+            self._stages.insert(0, next_stage)
+        for stage in self._stages:
+            self._stage_tasks.update(stage.start())
+
+    def _run_stage_coro(self, coro) -> asyncio.Task:
+        # a task of a stage, which is not drained by itself but by the saves waiting for it,
+        # may be started while the saver is draining, after stop
+        task = self._loop.create_task(coro)
+        self._stage_tasks.add(task)
+        task.add_done_callback(self._stage_tasks.discard)
+        return task
+
+    @property
+    def inflight(self) -> int:
+        # number of items being saved
+        return self._inflight
+
+    @property
+    def save_waiting(self) -> int:
+        # number of spider workers waiting for save_limit
+        return self._slots.waiting if self._slots is not None else 0
+
+    @property
+    def save_wait_time(self) -> float:
+        # total seconds spider workers waited for save_limit
+        return self._slots.wait_time if self._slots is not None else 0.0
+
+    def stage_stats(self) -> list:
+        # [{'processor': name, 'queued': n, 'processed': n, 'dropped': n, 'failed': n}]
+        return [stage.stats() for stage in self._stages]
+
+    def _collect_metrics(self, metrics):
+        metrics.set('saver_inflight', self._inflight)
+        metrics.set('saver_save_waiting', self.save_waiting)
+        metrics.set('saver_save_wait_seconds', self.save_wait_time)
+        for stage in list(self._stages):
+            metrics.set('saver_stage_queued', stage.queued, processor=stage.name)
+
+    def _record_stats(self):
+        self.runtime_data['saver'] = {'save_wait_time': round(self.save_wait_time, 6),
+                                      'cancelled': self._cancelled,
+                                      'stages': self.stage_stats()}
+
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # merges the saver's runtime data of a worker process, src, into dst, stages by processor name
+        saver = src.get('saver')
+        if saver is None:
+            return
+        merged = dst.setdefault('saver', {'save_wait_time': 0.0, 'cancelled': 0, 'stages': []})
+        sum_counters(merged, {k: v for k, v in saver.items() if k != 'stages'})
+        stages = {st['processor']: st for st in merged['stages']}
+        for st in saver['stages']:
+            if st['processor'] in stages:
+                sum_counters(stages[st['processor']], st)
+            else:
+                merged['stages'].append(dict(st))
+
+    async def acquire(self, loop):
+        # called by spiders on their own loop before save_released,
+        # waits while save_limit items are in flight
+        if self._slots is not None:
+            await self._slots.acquire(loop)
+
+    async def save_released(self, item):
+        # save, then release the slot taken by acquire
+        try:
+            await self.save(item)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
 
     async def save(self, item):
-        for p in self._processors:
-            await p.process(item)
+        # waits until the item has passed all stages, or has been dropped by one,
+        # raises the exception of a failed stage
+        if not self._stages:
+            return
+        self._inflight += 1
+        try:
+            job = _Job(item, self._loop.create_future())
+            await self._stages[0].put(job)
+            await job.future
+        finally:
+            self._inflight -= 1
+
+
+class _Job:
+    __slots__ = ('item', 'future', 'seq')
+
+    def __init__(self, item, future):
+        self.item = item
+        self.future = future
+        self.seq = None
+
+
+class _Stage:
+    # an item processor with its own bounded queue and workers
+    # put waits while the queue is full, so a slow stage pauses the stages before it
+    # without a concurrency, one worker starts a task for every item as it comes, so items are not limited
+    # an ordered stage with several workers passes items on in the order they came in
+    # processors with process_batch get up to batch_size items, waiting at most batch_delay for them
+
+    def __init__(self, saver, processor, next_stage):
+        settings = saver.settings
+        self._saver = saver
+        self._processor = processor
+        self._next = next_stage
+        self._loop = saver.loop
+
+        self._concurrency = processor.concurrency or settings.get('stage_concurrency')
+        assert self._concurrency is None or self._concurrency >= 1
+        self._ordered = processor.ordered and self._concurrency != 1
+        size = processor.queue_size or settings.get('stage_queue_size', 100)
+        self._queue = asyncio.Queue(size, loop=self._loop)
+
+        self._batched = processor.is_batched
+        if self._batched:
+            self._batch_size = processor.batch_size or settings.get('batch_size', 100)
+            assert self._batch_size >= 1
+            self._batch_delay = processor.batch_delay if processor.batch_delay is not None \
+                else settings.get('batch_delay', 1.0)
+        self._closed = self._loop.create_future()
+
+        self._in_seq = 0
+        self._out_seq = 0
+        self._finished = {}  # seq -> (job, passed), waiting for earlier jobs
+        self._lock = asyncio.Lock(loop=self._loop)
+
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return '<_Stage {}>'.format(self._processor)
+
+    def start(self) -> list:
+        return [self._saver.run_coro(self._work()) for _ in range(self._concurrency or 1)]
+
+    def close(self):
+        # flush batches without waiting for batch_delay
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    @property
+    def name(self) -> str:
+        return type(self._processor).__name__
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {'processor': self.name, 'queued': self.queued,
+                'processed': self.processed, 'dropped': self.dropped, 'failed': self.failed}
+
+    async def put(self, job):
+        await self._queue.put(job)
+
+    async def _get(self):
+        job = await self._queue.get()
+        job.seq = self._in_seq
+        self._in_seq += 1
+        return job
+
+    async def _collect(self) -> list:
+        jobs = [await self._get()]
+        deadline = self._loop.time() + self._batch_delay
+        while len(jobs) < self._batch_size:
+            if not self._queue.empty():
+                jobs.append(await self._get())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0 or self._closed.done():
+                break
+            getter = self._loop.create_task(self._get())
+            await asyncio.wait([getter, self._closed], timeout=timeout, loop=self._loop,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            jobs.append(getter.result())
+        return jobs
+
+    async def _work(self):
+        while True:
+            if self._batched:
+                jobs = await self._collect()
+            else:
+                jobs = [await self._get()]
+            if self._concurrency is None:
+                self._saver._run_stage_coro(self._process(jobs))
+            else:
+                await self._process(jobs)
+
+    async def _process(self, jobs):
+        p = self._processor
+        metrics = self._saver.metrics
+        passed = False
+        t0 = self._loop.time()
+        profiler = self._saver.profiler
+        record = None if profiler is None else profiler.start()
+        try:
+            if self._batched:
+                coro = p.process_batch([job.item for job in jobs])
+            else:
+                coro = p.process(jobs[0].item)
+            if record is None:
+                await coro
+            else:
+                await profiler.step(coro, record)
+        except asyncio.CancelledError:
+            raise
+        except DropItem as exc:
+            self.dropped += len(jobs)
+            self._saver.logger.debug('{} items dropped by {}: {!r}'.format(len(jobs), p, exc))
+            for job in jobs:
+                _resolve(job.future)
+        except Exception as exc:
+            self.failed += len(jobs)
+            if self._batched:
+                self._saver.logger.exception('Batch of {} items failed in {}.'.format(len(jobs), p))
+            else:
+                self._saver.logger.exception('Item {} failed in {}.'.format(jobs[0].item, p))
+            for job in jobs:
+                _resolve(job.future, exc)
+        else:
+            self.processed += len(jobs)
+            passed = True
+        if record is not None:
+            profiler.finish(self.name, record)
+        metrics.observe('item_process_seconds', self._loop.time() - t0, processor=self.name)
+        await self._emit(jobs, passed)
+
+    async def _emit(self, jobs, passed):
+        if not self._ordered:
+            for job in jobs:
+                await self._forward(job, passed)
+            return
+        for job in jobs:
+            self._finished[job.seq] = (job, passed)
+        async with self._lock:
+            while self._out_seq in self._finished:
+                job, passed = self._finished.pop(self._out_seq)
+                self._out_seq += 1
+                await self._forward(job, passed)
+
+    async def _forward(self, job, passed):
+        if not passed:
+            return
+        if self._next is None:
+            _resolve(job.future)
+        else:
+            await self._next.put(job)
+
+
+def _resolve(fut, exc=None):
+    if fut.done():
+        return
+    if exc is None:
+        fut.set_result(None)
+    else:
+        fut.set_exception(exc)
@@ -0,0 +1,217 @@
+from asyncio import Queue as AsyncQueue
+from asyncio import PriorityQueue as AsyncPriorityQueue
+from collections import deque
+import inspect
+import hashlib
+import pickle
+import sqlite3
+import time
+
+__all__ = ['FrontierEntry', 'Frontier', 'PriorityFrontier', 'PersistentFrontier']
+
+
+class FrontierEntry:
+    # an action waiting in a frontier
+
+    __slots__ = ('action', 'priority', 'depth', 'seq', 'key')
+
+    def __init__(self, action, priority, depth, seq):
+        self.action = action
+        self.priority = priority
+        self.depth = depth
+        self.seq = seq
+        self.key = None  # used by PersistentFrontier
+
+    def __lt__(self, other):
+        # higher priority first, then first in first out
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+    def __repr__(self):
+        return '<FrontierEntry {} priority={} depth={}>'.format(self.action, self.priority, self.depth)
+
+
+class Frontier:
+    # first in first out
+    # maxsize <= 0 means unbounded, put waits while the frontier is full
+
+    def __init__(self, spider, maxsize=0):
+        self._queue = self._make_queue(maxsize, spider.loop)
+
+    def _make_queue(self, maxsize, loop):
+        return AsyncQueue(maxsize, loop=loop)
+
+    def seen(self, entry: FrontierEntry) -> bool:
+        # True if the action of entry needs not to be driven
+        return False
+
+    def open(self):
+        # called when the spider starts
+        pass
+
+    async def put(self, entry: FrontierEntry):
+        await self._queue.put(entry)
+
+    def put_nowait(self, entry: FrontierEntry):
+        self._queue.put_nowait(entry)
+
+    async def get(self) -> FrontierEntry:
+        return await self._queue.get()
+
+    def done(self, entry: FrontierEntry):
+        # called when the action of entry has been driven, not called if it is cancelled
+        pass
+
+    def close(self):
+        pass
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def empty(self):
+        return self._queue.empty()
+
+    def full(self):
+        return self._queue.full()
+
+
+class PriorityFrontier(Frontier):
+    # higher priority first, first in first out among the same priority
+
+    def _make_queue(self, maxsize, loop):
+        return AsyncPriorityQueue(maxsize, loop=loop)
+
+
+class PersistentFrontier(PriorityFrontier):
+    # keeps descriptors of pending actions and keys of done actions in a sqlite database,
+    # a restarted spider restores pending actions and skips done ones
+    # an action is persisted as the name and arguments of the spider method which creates it,
+    # actions created otherwise, or with unpicklable arguments, are kept in memory only
+
+    commit_interval = 1.0
+    commit_ops = 1000
+
+    def __init__(self, spider, maxsize=0, path='frontier.db'):
+        PriorityFrontier.__init__(self, spider, maxsize)
+        self._spider = spider
+        self._path = path
+        self._db = None  # connected in open, by the spider's thread
+        self._pending = set()
+        self._restored = deque()
+        self._ops = 0
+        self._committed_at = time.monotonic()
+
+    def _describe(self, action):
+        # (name, args, kwargs) of the spider method which created the unstarted action
+        code, frame = action.ag_code, action.ag_frame
+        method = getattr(self._spider, code.co_name, None)
+        if frame is None or getattr(getattr(method, '__func__', None), '__code__', None) is not code:
+            return None
+        f_locals, names = frame.f_locals, code.co_varnames
+        argc, n = code.co_argcount, code.co_argcount + code.co_kwonlyargcount
+        if argc == 0 or f_locals.get(names[0]) is not self._spider:
+            return None
+        args = tuple(f_locals[name] for name in names[1:argc])
+        kwargs = {name: f_locals[name] for name in names[argc:n]}
+        if code.co_flags & inspect.CO_VARARGS:
+            args += tuple(f_locals[names[n]])
+            n += 1
+        if code.co_flags & inspect.CO_VARKEYWORDS:
+            kwargs.update(f_locals[names[n]])
+        return code.co_name, args, kwargs
+
+    def _register(self, entry) -> bool:
+        # returns False if the entry is pending or done already
+        desc = self._describe(entry.action)
+        if desc is None:
+            return True
+        try:
+            data = pickle.dumps(desc[1:])
+        except Exception:
+            self._spider.logger.debug('Action {} is not persisted.'.format(entry.action))
+            return True
+
+        key = hashlib.sha1(desc[0].encode() + b'\0' + data).digest()
+        if key in self._pending or self._is_done(key):
+            return False
+        entry.key = key
+        self._pending.add(key)
+        self._execute('INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?)',
+                      (key, entry.priority, entry.depth, desc[0], data))
+        return True
+
+    def _is_done(self, key):
+        return self._db.execute('SELECT 1 FROM done WHERE key = ?', (key,)).fetchone() is not None
+
+    def _execute(self, sql, params):
+        self._db.execute(sql, params)
+        self._ops += 1
+        now = time.monotonic()
+        if self._ops >= self.commit_ops or now - self._committed_at >= self.commit_interval:
+            self._db.commit()
+            self._ops = 0
+            self._committed_at = now
+
+    def _refill(self):
+        while self._restored and not self._queue.full():
+            self._queue.put_nowait(self._restored.popleft())
+
+    def seen(self, entry: FrontierEntry) -> bool:
+        return not self._register(entry)
+
+    def open(self):
+        self._db = sqlite3.connect(self._path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pending '
+                         '(key BLOB PRIMARY KEY, priority INTEGER, depth INTEGER, name TEXT, args BLOB)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS done (key BLOB PRIMARY KEY)')
+        self._db.commit()
+
+        spider = self._spider
+        rows = self._db.execute('SELECT key, priority, depth, name, args FROM pending ORDER BY rowid').fetchall()
+        for key, priority, depth, name, data in rows:
+            try:
+                args, kwargs = pickle.loads(data)
+                action = getattr(spider, name)(*args, **kwargs)
+            except Exception:
+                spider.logger.exception('Failed to restore action {}.'.format(name))
+                continue
+            entry = FrontierEntry(action, priority, depth, next(spider._seq))
+            entry.key = key
+            self._pending.add(key)
+            self._restored.append(entry)
+        if rows:
+            spider.logger.info('Restored {} pending actions.'.format(len(self._restored)))
+        self._refill()
+
+    async def put(self, entry: FrontierEntry):
+        if entry.key is not None or self._register(entry):
+            await self._queue.put(entry)
+
+    def put_nowait(self, entry: FrontierEntry):
+        if entry.key is not None or self._register(entry):
+            self._queue.put_nowait(entry)
+
+    async def get(self) -> FrontierEntry:
+        entry = await self._queue.get()
+        self._refill()
+        return entry
+
+    def done(self, entry: FrontierEntry):
+        key = entry.key
+        if key is not None:
+            self._pending.discard(key)
+            self._execute('DELETE FROM pending WHERE key = ?', (key,))
+            self._execute('INSERT OR IGNORE INTO done VALUES (?)', (key,))
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def qsize(self):
+        return self._queue.qsize() + len(self._restored)
+
+    def empty(self):
+        return self._queue.empty() and not self._restored
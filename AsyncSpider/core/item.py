@@ -11,6 +11,8 @@ class Field(dict):
 class ItemMeta(DefinedKeysDictMeta):
     def __new__(mcs, name, bases, namespace: dict):
         namespace.setdefault('fields', {})
+        # items keep their values in DefinedKeysDict._values only, without __dict__
+        namespace.setdefault('__slots__', ())
         return super().__new__(mcs, name, bases, namespace)
 
     def __init__(cls, name, bases, namespace):
@@ -26,6 +28,13 @@ class ItemMeta(DefinedKeysDictMeta):
         setattr(cls, '_keys', tuple(fields.keys()))
         super(ItemMeta, cls).__init__(name, bases, namespace)
 
+        # defaults are applied by copying _defaults, instead of looking up fields on every instantiation
+        defaults = list(cls._defaults)
+        for i, k in enumerate(cls._keys):
+            if 'default' in fields[k]:
+                defaults[i] = fields[k]['default']
+        setattr(cls, '_defaults', tuple(defaults))
+
 
 class Item(DefinedKeysDict, metaclass=ItemMeta):
     # keys' order is lost due to function in ItemMeta which collects fields by dict
@@ -40,15 +49,5 @@ class Item(DefinedKeysDict, metaclass=ItemMeta):
 
     fields = {}
 
-    def __init__(self, **kwargs):
-        for k in self._keys:
-            try:
-                d = self.fields[k]['default']
-            except KeyError:
-                pass
-            else:
-                kwargs.setdefault(k, d)
-        super().__init__(**kwargs)
-
     def __str__(self):
         return ''.join(('<', self.__class__.__name__, ' ', super().__repr__(), '>'))
@@ -1,30 +1,30 @@
-import logging.config
+from threading import Lock
+import logging
 import sys
 
-__all__ = ['logger']
+__all__ = ['logger', 'configure_logging']
 
 logger = logging.getLogger('AsyncSpider')
 
-logging.config.dictConfig(dict(
-    version=1,
-    loggers={
-        'AsyncSpider': {
-            'level': logging.INFO,
-            'handlers': ['console']
-        }
-    },
-    handlers={
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'std',
-            'level': logging.INFO,
-            'stream': sys.__stdout__
-        }
-    },
-    formatters={
-        'std': {
-            'format': '%(asctime)s [%(filename)s] [line:%(lineno)d] %(levelname)s: %(message)s',
-            'datefmt': '%Y:%m:%d %H:%M:%S',
-        }
-    }
-))
+_FORMAT = '%(asctime)s [%(filename)s] [line:%(lineno)d] %(levelname)s: %(message)s'
+_DATEFMT = '%Y:%m:%d %H:%M:%S'
+
+_lock = Lock()
+_configured = False
+
+
+def configure_logging():
+    # adds a console handler to logger, called by Controller, so importing has no side effects
+    # idempotent, and handlers or a level set by the user are kept
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.__stdout__)
+            handler.setLevel(logging.INFO)
+            handler.setFormatter(logging.Formatter(_FORMAT, _DATEFMT))
+            logger.addHandler(handler)
@@ -0,0 +1,174 @@
+from .log import logger
+from threading import Lock, Thread, Event
+from bisect import bisect_left
+import os
+
+__all__ = ['Histogram', 'Metrics']
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    # counts of observed values by upper bounds, the last count is for values above all buckets
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q) -> float:
+        # upper bound of the bucket which holds the q-quantile, inf if above all buckets
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        # cumulative counts, like prometheus
+        cumulative = {}
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            cumulative[bound] = total
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in pairs) + '}'
+
+
+class Metrics:
+    # thread safe counters, gauges and histograms, keyed by name and labels
+    # collectors are called by snapshot to set gauges which are read rather than pushed,
+    # e.g. queue depths
+
+    prefix = 'asyncspider_'
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def add_collector(self, func):
+        # func(metrics) is called by snapshot, by the thread which calls snapshot
+        with self._lock:
+            self._collectors.append(func)
+
+    def histogram(self, name, **labels) -> Histogram:
+        return self._histograms.get(_key(name, labels))
+
+    def _collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for func in collectors:
+            try:
+                func(self)
+            except Exception:
+                logger.exception('Metrics collector {} failed.'.format(func))
+
+    def snapshot(self) -> dict:
+        # {'counters': {name: [(labels, value)]}, 'gauges': ..., 'histograms': {name: [(labels, dict)]}}
+        self._collect()
+        result = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        with self._lock:
+            for kind, data in (('counters', self._counters), ('gauges', self._gauges)):
+                for (name, labels), value in sorted(data.items()):
+                    result[kind].setdefault(name, []).append((dict(labels), value))
+            for (name, labels), hist in sorted(self._histograms.items()):
+                result['histograms'].setdefault(name, []).append((dict(labels), hist.snapshot()))
+        return result
+
+    def to_prometheus(self) -> str:
+        # the text exposition format
+        self._collect()
+        lines = []
+        with self._lock:
+            for kind, data in (('counter', self._counters), ('gauge', self._gauges)):
+                last = None
+                for (name, labels), value in sorted(data.items()):
+                    name = self.prefix + name
+                    if name != last:
+                        lines.append('# TYPE {} {}'.format(name, kind))
+                        last = name
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+            last = None
+            for (name, labels), hist in sorted(self._histograms.items()):
+                name = self.prefix + name
+                if name != last:
+                    lines.append('# TYPE {} histogram'.format(name))
+                    last = name
+                snap = hist.snapshot()
+                for bound, n in snap['buckets'].items():
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, [('le', bound)]), n))
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, [('le', '+Inf')]), snap['count']))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), snap['sum']))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), snap['count']))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def write_prometheus(self, path):
+        # replaces the file atomically, for the textfile collector of node exporter
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def start_writer(self, path, interval):
+        # writes the file every interval seconds by a daemon thread,
+        # returns a function which stops the thread after writing the file once more
+        stopped = Event()
+
+        def write():
+            while not stopped.wait(interval):
+                self.write_prometheus(path)
+            self.write_prometheus(path)
+
+        thread = Thread(target=write, daemon=True)
+        thread.start()
+
+        def stop():
+            stopped.set()
+            thread.join()
+
+        return stop
@@ -0,0 +1,127 @@
+from .data import sum_counters
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from threading import Lock
+import multiprocessing
+import pickle
+import sys
+import time
+
+__all__ = ['ParsePool']
+
+
+def _call(data):
+    # runs in a worker process, returns the pickled result and the time spent on each step
+    t0 = time.perf_counter()
+    func, args, kwargs = pickle.loads(data)
+    t1 = time.perf_counter()
+    result = func(*args, **kwargs)
+    t2 = time.perf_counter()
+    result = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    t3 = time.perf_counter()
+    return result, t1 - t0 + t3 - t2, t2 - t1
+
+
+def _mp_context():
+    # the pool is created while threads of the controller are running, so its processes must not be forked
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class _PoolExecutor(Executor):
+    # a multiprocessing.Pool of _mp_context() as an executor,
+    # for 3.6 where ProcessPoolExecutor has no mp_context and always forks
+
+    def __init__(self, workers=None):
+        self._pool = _mp_context().Pool(workers)
+
+    def submit(self, fn, *args, **kwargs):
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+        self._pool.apply_async(fn, args, kwargs, callback=fut.set_result, error_callback=fut.set_exception)
+        return fut
+
+    def shutdown(self, wait=True):
+        if wait:
+            self._pool.close()
+            self._pool.join()
+        else:
+            self._pool.terminate()
+
+
+class ParsePool:
+    # a process pool for cpu bound parsing, shared by the spiders of a controller
+    # functions and their arguments must be picklable, e.g. module level functions and bytes
+    # arguments and results are pickled explicitly, so that the cost of serialization can be reported
+    # thread safe, the processes are created on first use, by forkserver or spawn, never forked
+
+    def __init__(self, workers=None):
+        self._workers = workers
+        self._executor = None
+        self._lock = Lock()
+
+        self.calls = 0
+        self.failed = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.serialize_time = 0.0  # pickling and unpickling, in both processes
+        self.parse_time = 0.0  # running functions in worker processes
+        self.wait_time = 0.0  # from submitting to getting results
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if sys.version_info >= (3, 7):
+                    self._executor = ProcessPoolExecutor(self._workers, mp_context=_mp_context())
+                else:
+                    # mp_context is new in 3.7
+                    self._executor = _PoolExecutor(self._workers)
+            return self._executor
+
+    async def run(self, loop, func, *args, **kwargs):
+        # awaits func(*args, **kwargs) run in a worker process, on loop of the caller
+        t0 = time.perf_counter()
+        data = pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        t1 = time.perf_counter()
+        try:
+            result, child_serialize_time, parse_time = \
+                await loop.run_in_executor(self._get_executor(), _call, data)
+        except Exception:
+            with self._lock:
+                self.calls += 1
+                self.failed += 1
+                self.sent_bytes += len(data)
+                self.serialize_time += t1 - t0
+                self.wait_time += time.perf_counter() - t1
+            raise
+        t2 = time.perf_counter()
+        value = pickle.loads(result)
+        t3 = time.perf_counter()
+
+        with self._lock:
+            self.calls += 1
+            self.sent_bytes += len(data)
+            self.received_bytes += len(result)
+            self.serialize_time += t1 - t0 + t3 - t2 + child_serialize_time
+            self.parse_time += parse_time
+            self.wait_time += t2 - t1
+        return value
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait)
+
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # every worker process has its own pool, so all of its stats are summed
+        if 'parse_pool' in src:
+            sum_counters(dst.setdefault('parse_pool', {}), src['parse_pool'])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'calls': self.calls, 'failed': self.failed,
+                    'sent_bytes': self.sent_bytes, 'received_bytes': self.received_bytes,
+                    'serialize_time': round(self.serialize_time, 6),
+                    'parse_time': round(self.parse_time, 6),
+                    'wait_time': round(self.wait_time, 6)}
@@ -13,11 +13,21 @@ class BaseProcessor:
     def on_stop(self):
         pass
 
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # merges what this processor wrote to the runtime data of a worker process, src, into dst,
+        # called by Controller.run_all_processes, a subclass which writes runtime data overrides it
+        pass
+
     async def process(self, value):
         pass
 
 
 class RequestProcessor(BaseProcessor):
+    # resend: if True, process is called again for every retry and hedge of a request, e.g. by rate limiters,
+    # with a copy of the processed request
+    resend = False
+
     def __init__(self, fetcher):
         BaseProcessor.__init__(self)
         self._fetcher = weakref.proxy(fetcher)
@@ -31,6 +41,22 @@ class RequestProcessor(BaseProcessor):
 
 
 class ItemProcessor(BaseProcessor):
+    # each item processor is a stage of the saver's pipeline, with its own queue and workers
+    # concurrency: number of workers, None means settings['stage_concurrency'] (default None),
+    #   and None there means no limit, every item is processed by its own task
+    # ordered: if True, items are passed to the next stage in the order they came in
+    # queue_size: max number of waiting items, None means settings['stage_queue_size'] (default 100)
+    # raise DropItem in process to stop an item from reaching later stages
+    concurrency = None
+    ordered = True
+    queue_size = None
+
+    # a subclass which overrides process_batch gets items in batches instead of process,
+    # a batch is flushed when it has batch_size items or its first item has waited batch_delay seconds
+    # None means settings['batch_size'] (default 100) and settings['batch_delay'] (default 1.0)
+    batch_size = None
+    batch_delay = None
+
     def __init__(self, saver):
         BaseProcessor.__init__(self)
         self._saver = weakref.proxy(saver)
@@ -39,5 +65,12 @@ class ItemProcessor(BaseProcessor):
     def saver(self) -> Saver:
         return self._saver
 
+    @property
+    def is_batched(self) -> bool:
+        return type(self).process_batch is not ItemProcessor.process_batch
+
     async def process(self, item: Item):
         pass
+
+    async def process_batch(self, items: list):
+        pass
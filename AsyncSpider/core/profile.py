@@ -0,0 +1,119 @@
+from threading import Lock, local
+import time
+import types
+
+__all__ = ['Profiler']
+
+
+class _Record:
+    # timing of one run of an action or a processor
+
+    __slots__ = ('start', 'fetch', 'cpu')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.fetch = 0.0
+        self.cpu = 0.0
+
+
+class Profiler:
+    # aggregates wall time, time awaiting fetch and time running on the cpu by name,
+    # names are qualified names of action functions and class names of processors
+    # cpu time is measured by timing each step of the coroutine, so awaits are excluded
+    # actions driven in place by their parents are included in the wall time of the parents
+    # runs slower than threshold seconds are logged
+    # thread safe, records of each thread are kept apart
+
+    def __init__(self, logger, threshold=1.0):
+        self._logger = logger
+        self.threshold = threshold
+        self._lock = Lock()
+        self._local = local()
+        self._stats = {}  # name -> [count, wall, fetch, cpu, max wall]
+
+    @property
+    def active(self) -> _Record:
+        # the record of the coroutine which is running in this thread
+        return getattr(self._local, 'record', None)
+
+    def start(self) -> _Record:
+        return _Record()
+
+    @types.coroutine
+    def step(self, awaitable, record: _Record):
+        # awaits awaitable, adding the time of its steps to record.cpu
+        it = awaitable.__await__()
+        send, value = it.send, None
+        lc = self._local
+        while True:
+            prev = getattr(lc, 'record', None)
+            lc.record = record
+            t0 = time.perf_counter()
+            try:
+                fut = send(value)
+            except StopIteration as exc:
+                return exc.value
+            finally:
+                record.cpu += time.perf_counter() - t0
+                lc.record = prev
+            try:
+                value = yield fut
+            except BaseException as exc:
+                send, value = it.throw, exc
+            else:
+                send = it.send
+
+    def add_fetch(self, seconds):
+        # called by Spider._run_on_fetcher, in a step of the action which awaited the fetch
+        record = self.active
+        if record is not None:
+            record.fetch += seconds
+
+    def finish(self, name, record: _Record):
+        wall = time.perf_counter() - record.start
+        with self._lock:
+            st = self._stats.get(name)
+            if st is None:
+                st = self._stats[name] = [0, 0.0, 0.0, 0.0, 0.0]
+            st[0] += 1
+            st[1] += wall
+            st[2] += record.fetch
+            st[3] += record.cpu
+            if wall > st[4]:
+                st[4] = wall
+        if wall > self.threshold:
+            self._logger.warning('Slow {}: wall {:.3f}s, fetch {:.3f}s, cpu {:.3f}s'.format(
+                name, wall, record.fetch, record.cpu))
+
+    def stats(self) -> dict:
+        # {name: {'count', 'wall', 'fetch', 'cpu', 'max_wall'}}, by total wall time descending
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {name: {'count': c, 'wall': round(w, 6), 'fetch': round(f, 6), 'cpu': round(u, 6),
+                       'max_wall': round(m, 6)}
+                for name, (c, w, f, u, m) in items}
+
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # merges the profile of a worker process, src, into dst, max_wall is the max of both
+        profile = src.get('profile')
+        if profile is None:
+            return
+        merged = dst.setdefault('profile', {})
+        for name, st in profile.items():
+            old = merged.get(name)
+            if old is None:
+                merged[name] = dict(st)
+            else:
+                for key in ('count', 'wall', 'fetch', 'cpu'):
+                    old[key] += st[key]
+                old['max_wall'] = max(old['max_wall'], st['max_wall'])
+
+    def dump(self, limit=20):
+        # logs the names with the most wall time
+        lines = ['{:<40} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+            'name', 'count', 'wall', 'fetch', 'cpu', 'max wall')]
+        for name, st in list(self.stats().items())[:limit]:
+            lines.append('{:<40} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                name, st['count'], st['wall'], st['fetch'], st['cpu'], st['max_wall']))
+        self._logger.info('Profile:\n' + '\n'.join(lines))
@@ -1,9 +1,13 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from collections import OrderedDict
+from threading import Lock
 import codecs
+import hashlib
 import json
+import re
 import aiohttp
-import chardet
 
-__all__ = ['Request', 'Response']
+__all__ = ['Request', 'Response', 'StreamResponse', 'canonical_url']
 
 
 class Request(dict):
@@ -11,6 +15,58 @@ class Request(dict):
     def __init__(self, method, url, **kwargs):
         dict.__init__(self, method=method, url=url, **kwargs)
 
+    def fingerprint(self) -> bytes:
+        # sha1 of method, canonical url with params, and body
+        h = hashlib.sha1()
+        h.update(self['method'].upper().encode())
+        h.update(b'\0')
+        h.update(canonical_url(self['url'], self.get('params')).encode())
+        h.update(b'\0')
+        h.update(_body_bytes(self.get('data'), self.get('json')))
+        return h.digest()
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonical_url(url, params=None) -> str:
+    # lower scheme and host, no default port, no fragment, sorted query merged with params
+    parts = urlsplit(str(url))
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, parts.port)
+    if parts.username is not None:
+        netloc = '{}@{}'.format(parts.username, netloc)
+
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        if isinstance(params, str):
+            query.extend(parse_qsl(params, keep_blank_values=True))
+        elif hasattr(params, 'items'):
+            query.extend(params.items())
+        else:
+            query.extend(params)
+    query = urlencode(sorted((str(k), str(v)) for k, v in query))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def _body_bytes(data, json_data) -> bytes:
+    if json_data is not None:
+        return json.dumps(json_data, sort_keys=True).encode()
+    if data is None:
+        return b''
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode()
+    if hasattr(data, 'items'):
+        data = data.items()
+    try:
+        return urlencode(sorted((str(k), str(v)) for k, v in data)).encode()
+    except (TypeError, ValueError):
+        return repr(data).encode()
+
 
 class Response:
     # data class for client response
@@ -18,9 +74,10 @@ class Response:
     __slots__ = ('_method', '_url', '_status', '_content', '_encoding', '_headers', '_cookies', '_host', '_history')
 
     @classmethod
-    async def from_client_response(cls, resp: aiohttp.ClientResponse):
+    async def from_client_response(cls, resp: aiohttp.ClientResponse, read=True):
+        # the response has no content if read is False
         return cls(method=resp.method, url=str(resp.url),
-                   status=resp.status, content=await resp.read(),
+                   status=resp.status, content=await resp.read() if read else None,
                    headers=resp.headers, cookies=resp.cookies,
                    host=resp.host, history=resp.history)
 
@@ -88,9 +145,10 @@ class Response:
                 # RFC 7159 states that the default encoding is UTF-8.
                 encoding = 'utf-8'
             else:
-                encoding = chardet.detect(self._content)['encoding']
+                encoding = _detect_encoding(self._content, self._host)
         if not encoding:
             encoding = 'utf-8'
+        encoding = _SUPERSETS.get(encoding.lower(), encoding)
 
         self._encoding = encoding
         return encoding
@@ -108,3 +166,132 @@ class Response:
 
     def json(self, **kwargs):
         return json.loads(self.text(), **kwargs)
+
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# decoding with a superset is always safe, and pages often use characters out of their declared charset
+_SUPERSETS = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'ascii': 'utf-8'}
+
+_META_SIZE = 2 ** 12
+_DETECT_SIZE = 2 ** 14
+_META_RE = re.compile(br'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+_NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+
+# last multi-byte encoding of a host, least recently used first
+# single-byte encodings decode any bytes, so a cached one would never be rejected, and are not cached
+_HOST_CACHE_SIZE = 2 ** 12
+_host_encodings = OrderedDict()
+_host_encodings_lock = Lock()  # responses are decoded by threads of spiders and fetchers
+_MULTI_BYTE = {codecs.lookup(e).name for e in (
+    'utf-8', 'gb18030', 'gbk', 'gb2312', 'big5', 'big5hkscs', 'shift_jis', 'cp932', 'euc_jp',
+    'euc_jis_2004', 'euc_kr', 'cp949', 'johab', 'iso2022_jp', 'iso2022_kr', 'hz', 'utf-16', 'utf-32')}
+
+
+def _lookup(encoding):
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def _can_decode(data, encoding):
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(data, False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def _detect_encoding(content, host):
+    # order: BOM, <meta charset>, last encoding of the host, statistical detection
+    # only a bounded part of the content is inspected
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return encoding
+
+    m = _META_RE.search(content, 0, _META_SIZE)
+    encoding = _lookup(m.group(1).decode('ascii')) if m else None
+    if encoding is None:
+        m = _NON_ASCII_RE.search(content)
+        if m is None:
+            return 'utf-8'
+        # leading ascii tells nothing, detect from the first non-ascii byte
+        sample = content[m.start():m.start() + _DETECT_SIZE]
+
+        with _host_encodings_lock:
+            encoding = _host_encodings.get(host)
+            if encoding is not None:
+                _host_encodings.move_to_end(host)
+        if encoding is None or not _can_decode(sample, encoding):
+            # chardet is slow to import, and only needed here
+            import chardet
+            encoding = chardet.detect(sample)['encoding']
+            if not encoding:
+                return None
+
+    if host is not None and _lookup(encoding) in _MULTI_BYTE:
+        with _host_encodings_lock:
+            _host_encodings[host] = encoding
+            _host_encodings.move_to_end(host)
+            while len(_host_encodings) > _HOST_CACHE_SIZE:
+                _host_encodings.popitem(last=False)
+    return encoding
+
+
+class StreamResponse(Response):
+    # response whose body is read on demand, chunk by chunk
+    # aiohttp pauses reading the connection while its small buffer is full,
+    # so memory is bounded no matter how large the body is
+
+    __slots__ = ('_client_response', '_run')
+
+    @classmethod
+    def from_client_response(cls, resp: aiohttp.ClientResponse, read=False):
+        assert not read
+        return cls(resp, method=resp.method, url=str(resp.url),
+                   status=resp.status, content=None,
+                   headers=resp.headers, cookies=resp.cookies,
+                   host=resp.host, history=resp.history)
+
+    def __init__(self, client_response, **kwargs):
+        Response.__init__(self, **kwargs)
+        self._client_response = client_response
+        self._run = _await
+
+    def bind(self, run):
+        # run(coro) is awaited to execute coro in the loop of the client response
+        self._run = run
+
+    async def read(self, n=-1) -> bytes:
+        return await self._run(self._client_response.content.read(n))
+
+    async def iter_chunked(self, n):
+        while True:
+            chunk = await self.read(n)
+            if not chunk:
+                break
+            yield chunk
+
+    async def release(self):
+        await self._run(_release(self._client_response))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
+
+
+async def _await(coro):
+    return await coro
+
+
+async def _release(resp):
+    resp.release()
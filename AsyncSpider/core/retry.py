@@ -0,0 +1,107 @@
+from email.utils import parsedate_to_datetime
+import random
+import time
+
+__all__ = ['RetryPolicy', 'CircuitBreaker', 'parse_retry_after']
+
+
+def parse_retry_after(value):
+    # seconds to wait by a Retry-After header, which is seconds or an http date, None if it is invalid
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class RetryPolicy:
+    # which requests are retried, and how long to wait before each retry
+    # the wait is drawn uniformly from [0, min(backoff_max, backoff * 2 ** (retry - 1))], the "full jitter"
+    # a 429 or 503 response with Retry-After waits as long as it asks, if that is not longer than backoff_max
+
+    def __init__(self, times=0, statuses=(408, 429, 500, 502, 503, 504), exceptions=(),
+                 methods=('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'), backoff=0.5, backoff_max=30.0):
+        self.times = times
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.methods = frozenset(m.upper() for m in methods)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    def allows(self, method) -> bool:
+        return self.times > 0 and method.upper() in self.methods
+
+    def delay(self, retry) -> float:
+        # retry counts from 1
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (retry - 1)))
+
+    def retry_after(self, status, headers):
+        # seconds asked by Retry-After of a 429 or 503 response, None if there is none
+        if status not in (429, 503):
+            return None
+        return parse_retry_after(headers.get('Retry-After'))
+
+
+class CircuitBreaker:
+    # a host is opened after `threshold` failed requests in a row, and requests to it are rejected for `cooldown` seconds
+    # after the cooldown the host is half open: one request is let through as a probe, the others are still rejected,
+    # a success closes the host and a failure opens it again, a probe which never reports is replaced after a cooldown
+    # threshold <= 0 disables the breaker
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}  # host -> failures in a row
+        self._open_until = {}  # host -> time.monotonic() when a probe is let through
+        self._probing = set()  # half open hosts with a probe in flight
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self, host) -> bool:
+        until = self._open_until.get(host)
+        if until is None:
+            return True
+        now = time.monotonic()
+        if now < until:
+            self.rejected += 1
+            return False
+        # this request is the probe
+        self._open_until[host] = now + self.cooldown
+        self._probing.add(host)
+        return True
+
+    def success(self, host):
+        self._failures.pop(host, None)
+        self._open_until.pop(host, None)
+        self._probing.discard(host)
+
+    def failure(self, host):
+        if self.threshold <= 0:
+            return
+        if host in self._probing:
+            self._probing.discard(host)
+            self._open(host)
+            return
+        n = self._failures[host] = self._failures.get(host, 0) + 1
+        if n >= self.threshold and host not in self._open_until:
+            self._open(host)
+
+    def _open(self, host):
+        self._open_until[host] = time.monotonic() + self.cooldown
+        self.opened += 1
+
+    def open_hosts(self) -> list:
+        # hosts which reject requests, half open ones included while their probe is in flight
+        now = time.monotonic()
+        return [host for host, until in self._open_until.items() if until > now]
+
+    def stats(self) -> dict:
+        return {'opened': self.opened, 'rejected': self.rejected, 'open_hosts': self.open_hosts(),
+                'half_open': sorted(self._probing)}
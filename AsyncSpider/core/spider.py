@@ -1,30 +1,52 @@
 from .base import AioThreadExecutor, ControllerShortcutMixin
 from .item import Item
 from .fetsav import Fetcher, Saver
-from .reqrep import Response
-from asyncio import Queue as AsyncQueue
+from .reqrep import Response, StreamResponse
+from .frontier import FrontierEntry, Frontier, PriorityFrontier, PersistentFrontier
+from ..exceptions import DropRequest
 from asyncio import wrap_future
-from collections import AsyncGenerator
+from asyncio import CancelledError
+from collections import deque
+from collections.abc import AsyncGenerator
+import asyncio
+import itertools
 
 __all__ = ['Spider']
 
+# actions driven in place inside each other by one worker, deeper ones wait in the worker's overflow
+_MAX_DRIVE_DEPTH = 16
+
+
+class _WorkerState:
+    __slots__ = ('depth', 'overflow')
+
+    def __init__(self):
+        self.depth = 0  # actions being driven in place
+        self.overflow = deque()  # entries driven after the current one
+
 
 class Spider(AioThreadExecutor, ControllerShortcutMixin):
     def __init__(self, controller):
         ControllerShortcutMixin.__init__(self, controller)
-        AioThreadExecutor.__init__(self)
+        AioThreadExecutor.__init__(self, controller.loop)
 
         self.concurrency = self.settings['concurrency']
         assert self.concurrency >= 1
 
         self.stop_when_empty = self.settings.get('stop_when_empty', True)
+        self.max_depth = self.settings.get('max_depth', None)
+        self._action_priorities = self.settings.get('action_priorities', {})
 
-        self._action_queue = AsyncQueue(loop=self._loop)
+        self._frontier = self.make_frontier()
+        self._seq = itertools.count()
         self._working_num = 0
+        self._workers = {}  # task -> _WorkerState
 
-        self.call_on_start(self._action_queue.put_nowait, self.start_action())
+        self.metrics.add_collector(self._collect_metrics)
+        self.call_on_start(self._put_start_action)
+        self.call_on_stop(self._frontier.close)
         for _ in range(self.concurrency):
-            self.call_on_start(self.run_coro, self._worker())
+            self.call_on_start(self._start_worker)
 
     @property
     def fetcher(self) -> Fetcher:
@@ -34,46 +56,226 @@ class Spider(AioThreadExecutor, ControllerShortcutMixin):
     def saver(self) -> Saver:
         return self._controller.saver
 
+    @property
+    def shard(self) -> tuple:
+        # (index, count), set by Controller.run_all_processes
+        return self.settings.get('shard', (0, 1))
+
+    @staticmethod
+    def merge_runtime_data(dst: dict, src: dict):
+        # merges what this spider wrote to the runtime data of a worker process, src, into dst,
+        # called by Controller.run_all_processes, a subclass which writes runtime data overrides it
+        pass
+
+    def partition(self, iterable):
+        # yields the part of iterable which belongs to this shard
+        index, count = self.shard
+        return itertools.islice(iterable, index, None, count)
+
+    def _collect_metrics(self, metrics):
+        name = self.__class__.__name__
+        metrics.set('spider_queue_depth', self._frontier.qsize(), spider=name)
+        metrics.set('spider_working', self._working_num, spider=name)
+        metrics.set('spider_concurrency', self.concurrency, spider=name)
+
+    def make_frontier(self) -> Frontier:
+        # settings:
+        #   frontier: 'fifo', 'priority' or 'persistent'
+        #   frontier_size: 0, max number of waiting actions, 0 means unbounded
+        #   frontier_path: '{name}.{shard}.frontier.db', database of 'persistent'
+        kind = self.settings.get('frontier', 'fifo')
+        maxsize = self.settings.get('frontier_size', 0)
+        if kind == 'fifo':
+            return Frontier(self, maxsize)
+        elif kind == 'priority':
+            return PriorityFrontier(self, maxsize)
+        elif kind == 'persistent':
+            path = self.settings.get('frontier_path', '{name}.{shard}.frontier.db')
+            path = path.format(name=self.__class__.__name__, shard=self.shard[0])
+            return PersistentFrontier(self, maxsize, path)
+        raise ValueError('unknown frontier: {!r}'.format(kind))
+
+    def priority(self, action, depth) -> int:
+        # higher priority is driven first by PriorityFrontier
+        # by default, settings['action_priorities'] maps action function names to priorities
+        return self._action_priorities.get(action.__name__, 0)
+
+    def _make_entry(self, action, depth):
+        return FrontierEntry(action, self.priority(action, depth), depth, next(self._seq))
+
+    def _put_start_action(self):
+        self._frontier.open()
+        self._frontier.put_nowait(self._make_entry(self.start_action(), 0))
+        # a persistent frontier skips a done start action, and may restore nothing
+        self.call_soon(self._stop_if_idle)
+
+    def _stop_if_idle(self):
+        if self.stop_when_empty and self._working_num == 0 and self._frontier.empty() and self.is_running:
+            self.stop()
+
+    def _worker_state(self):
+        # None if not called by a worker
+        return self._workers.get(asyncio.Task.current_task(loop=self._loop))
+
     async def add_action(self, action):
+        # called by other tasks, waits while the frontier is full
+        # called by actions, drives the action in place while the frontier is full
         assert isinstance(action, AsyncGenerator)
-        await self._action_queue.put(action)
+        entry = self._make_entry(action, 0)
+        state = self._worker_state()
+        if state is None:
+            await self._frontier.put(entry)
+        elif not self._frontier.seen(entry):
+            await self._put_or_drive(entry, state)
+
+    async def _add_child(self, action, depth):
+        if self.max_depth is not None and depth > self.max_depth:
+            self.logger.debug('Action {} dropped, depth {} > max_depth'.format(action, depth))
+            return
+        entry = self._make_entry(action, depth)
+        if self._frontier.seen(entry):
+            return
+        state = self._worker_state()
+        if state is None:
+            await self._frontier.put(entry)
+        else:
+            await self._put_or_drive(entry, state)
+
+    async def _put_or_drive(self, entry, state):
+        # workers never wait for the frontier, otherwise all of them could wait for each other,
+        # a full frontier makes the parent drive the action in place, which pauses the parent,
+        # past _MAX_DRIVE_DEPTH the action waits in the worker's overflow, so that the stack stays small
+        if not self._frontier.full():
+            self._frontier.put_nowait(entry)
+        elif state.depth >= _MAX_DRIVE_DEPTH:
+            state.overflow.append(entry)
+        else:
+            state.depth += 1
+            try:
+                await self._drive_entry(entry)
+            finally:
+                state.depth -= 1
+            self._frontier.done(entry)
+
+    async def _run_on_fetcher(self, coro):
+        # the time is added to the profile of the action which awaits it
+        profiler = self.profiler
+        t0 = self._loop.time()
+        try:
+            if self.fetcher.loop is self._loop:
+                return await coro
+            fut = self.fetcher.run_coro_threadsafe(coro)
+            fut = wrap_future(fut, loop=self._loop)
+            return await fut
+        finally:
+            if profiler is not None:
+                profiler.add_fetch(self._loop.time() - t0)
 
     async def fetch(self, method, url, **kwargs) -> Response:
-        fut = self.fetcher.run_coro_threadsafe(self.fetcher.fetch(method, url, **kwargs))
-        fut = wrap_future(fut, loop=self._loop)
-        return await fut
+        return await self._run_on_fetcher(self.fetcher.fetch(method, url, **kwargs))
+
+    async def fetch_stream(self, method, url, **kwargs) -> StreamResponse:
+        """ Usage:
+        async with await self.fetch_stream('get', url) as resp:
+            async for chunk in resp.iter_chunked(2 ** 16):
+                ...
+        """
+        resp = await self._run_on_fetcher(self.fetcher.fetch_stream(method, url, **kwargs))
+        resp.bind(self._run_on_fetcher)
+        return resp
+
+    async def fetch_to(self, method, url, sink, chunk_size=2 ** 16, **kwargs) -> Response:
+        coro = self.fetcher.fetch_to(method, url, sink, chunk_size=chunk_size, **kwargs)
+        return await self._run_on_fetcher(coro)
+
+    async def run_in_parse_pool(self, func, content, *args, **kwargs):
+        """ Usage:
+        links = await self.run_in_parse_pool(extract_links, resp)
+        runs func(content, *args, **kwargs) in the controller's parse pool, without blocking this spider,
+        func must be picklable, e.g. a module level function, a response is passed as its content bytes
+        """
+        if isinstance(content, Response):
+            content = content.content
+        return await self._controller.parse_pool.run(self._loop, func, content, *args, **kwargs)
 
     async def save(self, item, wait=False):
-        fut = self.saver.run_coro_threadsafe(self.saver.save(item))
+        # waits while settings['save_limit'] items are in flight
+        await self.saver.acquire(self._loop)
+        if self.saver.loop is self._loop:
+            if wait:
+                await self.saver.save_released(item)
+            else:
+                self.saver.run_coro(self.saver.save_released(item))
+            return
+        fut = self.saver.run_coro_threadsafe(self.saver.save_released(item))
         if wait:
             fut = wrap_future(fut, loop=self._loop)
             await fut
 
+    def _start_worker(self):
+        task = self.run_coro(self._worker())
+        self._workers[task] = _WorkerState()
+        task.add_done_callback(self._remove_worker)
+
+    def _remove_worker(self, task):
+        self._workers.pop(task, None)
+
     async def _worker(self):
+        state = self._worker_state()
         while True:
-            act = await self._action_queue.get()
+            entry = await self._frontier.get()
 
             self._working_num += 1
             try:
-                await self._drive(act)
-            except Exception:
-                self.logger.exception('Action {} failed.'.format(act))
+                await self._drive_entry(entry)
+                self._frontier.done(entry)
+                # overflow of the entry, put back, or driven here if the frontier is still full
+                while state.overflow:
+                    await self._put_or_drive(state.overflow.popleft(), state)
             finally:
                 self._working_num -= 1
-                self._action_queue.task_done()
-                if self.stop_when_empty and self._working_num == 0 and self._action_queue.empty():
-                    self._loop.stop()
+                self._stop_if_idle()
+
+    async def _drive_entry(self, entry):
+        act = entry.action
+        try:
+            await self._drive(act, entry.depth)
+        except CancelledError:
+            raise
+        except DropRequest as exc:
+            self.logger.debug('Action {} dropped: {!r}'.format(act, exc))
+        except Exception:
+            self.logger.exception('Action {} failed.'.format(act))
 
-    async def _drive(self, action):
+    async def _drive(self, action, depth=0):
+        if self.profiler is not None:
+            await self._drive_profiled(action, depth)
+            return
         async for obj in action:
-            if obj is None:
-                pass
-            elif isinstance(obj, AsyncGenerator):
-                await self.add_action(obj)
-            elif isinstance(obj, Item):
-                await self.save(obj, wait=False)
-            else:
-                self.logger.warning('{} yield an unexpected object: {}'.format(action, obj))
+            await self._handle(action, obj, depth)
+
+    async def _drive_profiled(self, action, depth):
+        profiler = self.profiler
+        record = profiler.start()
+        try:
+            while True:
+                try:
+                    obj = await profiler.step(action.__anext__(), record)
+                except StopAsyncIteration:
+                    break
+                await self._handle(action, obj, depth)
+        finally:
+            profiler.finish(action.__qualname__, record)
+
+    async def _handle(self, action, obj, depth):
+        if obj is None:
+            pass
+        elif isinstance(obj, AsyncGenerator):
+            await self._add_child(obj, depth + 1)
+        elif isinstance(obj, Item):
+            await self.save(obj, wait=False)
+        else:
+            self.logger.warning('{} yield an unexpected object: {}'.format(action, obj))
 
     async def start_action(self):
         yield
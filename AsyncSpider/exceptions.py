@@ -3,7 +3,7 @@ from concurrent.futures import TimeoutError
 __all__ = ['BaseSpiderException',
 
            'FetcherException',
-           'RequestFailError', 'DropRequest', 'TimeoutError',
+           'RequestFailError', 'DropRequest', 'CircuitOpenError', 'TimeoutError',
 
            'SaverException',
            'ItemFailError', 'DropItem',
@@ -29,6 +29,10 @@ class DropRequest(RequestFailError):
     pass
 
 
+class CircuitOpenError(RequestFailError):
+    pass
+
+
 class SaverException(BaseSpiderException):
     pass
 
@@ -1,6 +1,13 @@
-from ..core import ItemProcessor
+from ..core import ItemProcessor, sum_counters
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import time
 
-__all__ = ['LogIP', 'CountItemIP']
+__all__ = ['LogIP', 'CountItemIP', 'FeedExportIP', 'SqliteIP']
 
 
 class LogIP(ItemProcessor):
@@ -13,3 +20,268 @@ class CountItemIP(ItemProcessor):
         c = self.saver.runtime_data.setdefault('item_count', 0)
         c += 1
         self.saver.runtime_data['item_count'] = c
+
+    @staticmethod
+    def merge_runtime_data(dst, src):
+        if 'item_count' in src:
+            dst['item_count'] = dst.get('item_count', 0) + src['item_count']
+
+
+class FeedExportIP(ItemProcessor):
+    # writes items to json lines or csv files, keys in the order of Item.all_keys()
+    # items are serialized into a buffer, which is written by a thread when it is full,
+    # so the saver's loop never waits for the disk except for backpressure
+    # settings:
+    #   feed_path: 'feed.{shard}.{index}.jsonl', '{index}' counts rotated files from 0
+    #   feed_format: None, 'jsonl' or 'csv', None means by the extension of feed_path
+    #   feed_buffer_size: 2 ** 20, bytes buffered before a write
+    #   feed_max_bytes: 0, rotate when a file has this many bytes before compression, 0 means never
+    #   feed_max_items: 0, rotate when a file has this many items, 0 means never
+    #   feed_gzip: False, compress files, '.gz' is appended to feed_path
+
+    concurrency = 1
+    ordered = True
+
+    def __init__(self, saver):
+        super().__init__(saver)
+        self._executor = None
+        self._file = None
+        self._index = 0
+        self._buffer = []
+        self._buffered = 0
+        self._file_bytes = 0
+        self._file_items = 0
+        self._header = None
+        self._csv_buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._csv_buffer)
+        self.items = 0
+        self.files = 0
+
+    def on_start(self):
+        settings = self.saver.settings
+        self._path = settings.get('feed_path', 'feed.{shard}.{index}.jsonl')
+        self._format = settings.get('feed_format') or ('csv' if self._path.endswith('.csv') else 'jsonl')
+        assert self._format in ('jsonl', 'csv')
+        self._buffer_size = settings.get('feed_buffer_size', 2 ** 20)
+        self._max_bytes = settings.get('feed_max_bytes', 0)
+        self._max_items = settings.get('feed_max_items', 0)
+        self._gzip = settings.get('feed_gzip', False)
+        self._shard = settings.get('shard', (0, 1))[0]
+        # one thread, so that writes are in order
+        self._executor = ThreadPoolExecutor(1)
+
+    def _file_path(self):
+        path = self._path.format(shard=self._shard, index=self._index)
+        return path + '.gz' if self._gzip else path
+
+    def _open(self, path):
+        # in the writer thread
+        return gzip.open(path, 'wb') if self._gzip else open(path, 'wb')
+
+    def _write(self, data):
+        # in the writer thread, opens the file on the first write
+        if self._file is None:
+            self._file = self._open(self._file_path())
+            self.files += 1
+        self._file.write(data)
+
+    def _close(self):
+        # in the writer thread
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _serialize(self, item) -> str:
+        if self._format == 'jsonl':
+            return json.dumps(item.to_dict(), ensure_ascii=False, default=str) + '\n'
+        buf = self._csv_buffer
+        if self._header is None:
+            self._header = tuple(item.all_keys())
+            self._csv_writer.writerow(self._header)
+        self._csv_writer.writerow(['' if item.get(k) is None else item[k] for k in self._header])
+        lines = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return lines
+
+    def _take_buffer(self) -> bytes:
+        data = b''.join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        return data
+
+    async def _flush(self):
+        if self._buffer:
+            data = self._take_buffer()
+            await self.saver.loop.run_in_executor(self._executor, self._write, data)
+
+    async def _rotate(self):
+        await self._flush()
+        await self.saver.loop.run_in_executor(self._executor, self._close)
+        self._index += 1
+        self._file_bytes = 0
+        self._file_items = 0
+        self._header = None
+
+    async def process(self, item):
+        if (self._max_items and self._file_items >= self._max_items) or \
+                (self._max_bytes and self._file_bytes >= self._max_bytes):
+            await self._rotate()
+
+        data = self._serialize(item).encode('utf8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._file_bytes += len(data)
+        self._file_items += 1
+        self.items += 1
+        if self._buffered >= self._buffer_size:
+            await self._flush()
+
+    def on_stop(self):
+        # the saver's loop is not running here
+        if self._executor is None:
+            return
+        if self._buffer:
+            self._executor.submit(self._write, self._take_buffer()).result()
+        self._executor.submit(self._close).result()
+        self._executor.shutdown()
+        self.saver.runtime_data['feed'] = {'items': self.items, 'files': self.files}
+
+    @staticmethod
+    def merge_runtime_data(dst, src):
+        if 'feed' in src:
+            sum_counters(dst.setdefault('feed', {}), src['feed'])
+
+
+class SqliteIP(ItemProcessor):
+    # inserts items in batches into a sqlite database, one table per item class, named after the class
+    # columns are the item's keys, typed by Field(type=...), unset keys are NULL
+    # a field with Field(key=True) is the primary key, and items with a stored key update the row,
+    # only the keys which are set in the item are updated
+    # inserts run by executemany in a writer thread, and are committed every commit interval
+    # settings:
+    #   sqlite_path: 'items.db'
+    #   sqlite_commit_interval: 1.0, seconds between commits
+
+    _types = {int: 'INTEGER', bool: 'INTEGER', float: 'REAL', str: 'TEXT', bytes: 'BLOB'}
+    _unset = object()  # marker of unset keys in to_tuple
+
+    def __init__(self, saver):
+        super().__init__(saver)
+        self._executor = None
+        self._db = None
+        self._pks = {}  # item class -> primary key or None, for created tables
+        self._statements = {}  # (item class, set keys) -> [(statement, indexes of its parameters in a row or None)]
+        self._committed_at = 0.0
+        self.rows = 0
+
+    def on_start(self):
+        settings = self.saver.settings
+        self._path = settings.get('sqlite_path', 'items.db')
+        self._commit_interval = settings.get('sqlite_commit_interval', 1.0)
+        # the connection is used by this thread only
+        self._executor = ThreadPoolExecutor(1)
+
+    def _connect(self):
+        self._db = sqlite3.connect(self._path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._committed_at = time.monotonic()
+
+    @staticmethod
+    def _quote(name):
+        return '"{}"'.format(name.replace('"', '""'))
+
+    def _table(self, cls):
+        # creates the table of cls if needed, returns its primary key
+        if cls in self._pks:
+            return self._pks[cls]
+        q = self._quote
+        columns, pk = [], None
+        for k in cls.all_keys():
+            field = cls.fields[k]
+            column = ' '.join(filter(None, (q(k), self._types.get(field.get('type'), ''))))
+            if field.get('key') and pk is None:
+                pk = k
+                column += ' PRIMARY KEY'
+            columns.append(column)
+        self._db.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(q(cls.__name__), ', '.join(columns)))
+        self._pks[cls] = pk
+        return pk
+
+    def _statement(self, cls, keys) -> list:
+        # statements of rows of cls with values of keys only, with the indexes of their parameters in a row,
+        # None means the row as it is
+        stmts = self._statements.get((cls, keys))
+        if stmts is not None:
+            return stmts
+        q = self._quote
+        pk = self._table(cls)
+        table = q(cls.__name__)
+        names = ', '.join(q(k) for k in keys)
+        marks = ', '.join('?' * len(keys))
+        others = [i for i, k in enumerate(keys) if k != pk]
+        if pk not in keys:
+            stmts = [('INSERT INTO {} ({}) VALUES ({})'.format(table, names, marks), None)]
+        elif not others:
+            stmts = [('INSERT OR IGNORE INTO {} ({}) VALUES ({})'.format(table, names, marks), None)]
+        elif sqlite3.sqlite_version_info >= (3, 24, 0):
+            updates = ', '.join('{0} = excluded.{0}'.format(q(keys[i])) for i in others)
+            stmts = [('INSERT INTO {} ({}) VALUES ({}) ON CONFLICT({}) DO UPDATE SET {}'.format(
+                table, names, marks, q(pk), updates), None)]
+        else:
+            # without upsert, the row is updated if it exists, and inserted otherwise
+            updates = ', '.join('{} = ?'.format(q(keys[i])) for i in others)
+            stmts = [('UPDATE {} SET {} WHERE {} = ?'.format(table, updates, q(pk)), others + [keys.index(pk)]),
+                     ('INSERT OR IGNORE INTO {} ({}) VALUES ({})'.format(table, names, marks), None)]
+        self._statements[(cls, keys)] = stmts
+        return stmts
+
+    @staticmethod
+    def _adapt(value):
+        if value is None or isinstance(value, (int, float, str, bytes)):
+            return value
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def _insert(self, groups):
+        # in the writer thread, groups: {(item class, set keys): [rows of values of set keys]}
+        if self._db is None:
+            self._connect()
+        for (cls, keys), rows in groups.items():
+            for stmt, indexes in self._statement(cls, keys):
+                params = rows if indexes is None else [tuple(row[i] for i in indexes) for row in rows]
+                self._db.executemany(stmt, params)
+            self.rows += len(rows)
+        now = time.monotonic()
+        if now - self._committed_at >= self._commit_interval:
+            self._db.commit()
+            self._committed_at = now
+
+    def _close(self):
+        # in the writer thread
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    async def process_batch(self, items):
+        groups = {}
+        adapt, unset = self._adapt, self._unset
+        for item in items:
+            cls = type(item)
+            values = item.to_tuple(unset)
+            keys = tuple(k for k, v in zip(cls.all_keys(), values) if v is not unset)
+            groups.setdefault((cls, keys), []).append(tuple(adapt(v) for v in values if v is not unset))
+        await self.saver.loop.run_in_executor(self._executor, self._insert, groups)
+
+    def on_stop(self):
+        if self._executor is None:
+            return
+        self._executor.submit(self._close).result()
+        self._executor.shutdown()
+        self.saver.runtime_data['sqlite'] = {'rows': self.rows}
+
+    @staticmethod
+    def merge_runtime_data(dst, src):
+        if 'sqlite' in src:
+            sum_counters(dst.setdefault('sqlite', {}), src['sqlite'])
@@ -6,8 +6,15 @@ __all__ = ['ImageItem']
 class ImageItem(Item):
     url = Field()
     content = Field()
+    path = Field()
 
     @classmethod
     async def load(cls, spider: Spider, img_url,**kwargs):
         resp = await spider.fetch('get', img_url,**kwargs)
         return cls(url=resp.url, content=resp.content)
+
+    @classmethod
+    async def download(cls, spider: Spider, img_url, path, **kwargs):
+        # the image is written to path instead of being kept in the item
+        resp = await spider.fetch_to('get', img_url, path, **kwargs)
+        return cls(url=resp.url, path=path)
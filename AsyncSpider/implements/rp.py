@@ -1,47 +1,173 @@
-from ..core import RequestProcessor, Request
-from fake_useragent import UserAgent
-import asyncio
+from ..core import RequestProcessor, Request, BloomFilter, sum_counters
+from ..exceptions import DropRequest
+from .useragents import USER_AGENTS
+from collections import deque
+from urllib.parse import urlsplit
+import random
 
-__all__ = ['TokenBucketRP', 'RandomUserAgentRP']
+__all__ = ['TokenBucket', 'TokenBucketRP', 'HostTokenBucketRP', 'DupeFilterRP', 'RandomUserAgentRP']
+
+
+class TokenBucket:
+    # tokens are refilled continuously at `rate` per second, up to `capacity`
+    # waiters are woken in FIFO order, one timer is scheduled for the head waiter only
+
+    def __init__(self, rate, capacity, loop):
+        assert rate > 0 and capacity >= 1
+        self._rate = rate
+        self._capacity = capacity
+        self._loop = loop
+        self._tokens = capacity
+        self._last = loop.time()
+        self._waiters = deque()
+        self._timer = None
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    def _refill(self):
+        now = self._loop.time()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def _schedule(self):
+        # sleep exactly until the next token is available
+        delay = max(0, (1 - self._tokens) / self._rate)
+        self._timer = self._loop.call_later(delay, self._wake_up)
+
+    def _wake_up(self):
+        self._timer = None
+        self._refill()
+        waiters = self._waiters
+        while waiters and self._tokens >= 1:
+            fut = waiters.popleft()
+            if fut.done():  # cancelled
+                continue
+            self._tokens -= 1
+            fut.set_result(None)
+        while waiters and waiters[0].done():
+            waiters.popleft()
+        if waiters:
+            self._schedule()
+
+    async def acquire(self):
+        if not self._waiters:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+        fut = self._loop.create_future()
+        self._waiters.append(fut)
+        if self._timer is None:
+            self._schedule()
+        await fut
 
 
 class TokenBucketRP(RequestProcessor):
+    # settings:
+    #   qps: tokens per second
+    #   max_qps: capacity of a bucket, the max burst
+    # retries and hedges of a request take tokens too
+
+    resend = True
+
     def __init__(self, fetcher):
         super().__init__(fetcher)
 
         self._qps = self.fetcher.settings['qps']
         self._max_qps = self.fetcher.settings['max_qps']
-        self._token_num = self._max_qps
+        self._buckets = {}
 
-        self._cond = asyncio.Condition(loop=fetcher.loop)
+    def key(self, request: Request):
+        # requests of the same key share a bucket
+        return None
 
-    async def _add_token(self):
-        while True:
-            await asyncio.sleep(1)
-            t = self._token_num + self._qps
-            if t > self._max_qps:
-                self._token_num = self._max_qps
-            else:
-                self._token_num = t
-            async with self._cond:
-                self._cond.notify_all()
+    def limit(self, key):
+        # (qps, max_qps) of the key
+        return self._qps, self._max_qps
 
-    async def acquire(self):
-        async with self._cond:
-            await self._cond.wait_for(lambda: self._token_num >= 1)
-            self._token_num -= 1
+    def get_bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            qps, max_qps = self.limit(key)
+            bucket = self._buckets[key] = TokenBucket(qps, max_qps, self.fetcher.loop)
+        return bucket
 
-    def on_start(self):
-        self.fetcher.run_coro(self._add_token())
+    async def acquire(self, key=None):
+        loop = self.fetcher.loop
+        t0 = loop.time()
+        await self.get_bucket(key).acquire()
+        self.fetcher.metrics.observe('token_bucket_wait_seconds', loop.time() - t0, bucket=key)
 
     async def process(self, request):
-        await self.acquire()
+        await self.acquire(self.key(request))
+
+
+class HostTokenBucketRP(TokenBucketRP):
+    # one bucket per host
+    # settings:
+    #   qps, max_qps: limit of hosts not in host_qps
+    #   host_qps: {host: (qps, max_qps)}
+
+    def __init__(self, fetcher):
+        super().__init__(fetcher)
+        self._host_qps = dict(self.fetcher.settings.get('host_qps', {}))
+
+    def key(self, request: Request):
+        return urlsplit(str(request['url'])).hostname
+
+    def limit(self, key):
+        return self._host_qps.get(key, (self._qps, self._max_qps))
+
+
+class DupeFilterRP(RequestProcessor):
+    # raises DropRequest for requests whose fingerprint has been seen,
+    # the spider drops the action which sends it
+    # settings:
+    #   dupefilter: 'set', exact, or 'bloom', memory-bounded with false positives
+    #   dupefilter_capacity: 10 ** 7, expected number of requests for 'bloom'
+    #   dupefilter_error_rate: 0.001, false positive rate for 'bloom'
+
+    def __init__(self, fetcher):
+        super().__init__(fetcher)
+        settings = self.fetcher.settings
+        kind = settings.get('dupefilter', 'set')
+        if kind == 'set':
+            self._seen = set()
+        elif kind == 'bloom':
+            self._seen = BloomFilter(settings.get('dupefilter_capacity', 10 ** 7),
+                                     settings.get('dupefilter_error_rate', 0.001))
+        else:
+            raise ValueError('unknown dupefilter: {!r}'.format(kind))
+        self.hits = 0
+        self.misses = 0
+
+    async def process(self, request: Request):
+        fp = request.fingerprint()
+        if fp in self._seen:
+            self.hits += 1
+            raise DropRequest('duplicate request: {} {}'.format(request['method'], request['url']))
+        self._seen.add(fp)
+        self.misses += 1
+
+    def on_stop(self):
+        self.fetcher.runtime_data['dupefilter'] = {'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def merge_runtime_data(dst, src):
+        if 'dupefilter' in src:
+            sum_counters(dst.setdefault('dupefilter', {}), src['dupefilter'])
 
 
 class RandomUserAgentRP(RequestProcessor):
-    ua = UserAgent()
+    # user agents are drawn from a bundled pool, subclasses can replace user_agents with their own sequence
+
+    user_agents = USER_AGENTS
 
     async def process(self, request: Request):
         h = request.get('headers', {})
-        h['User-Agent'] = self.ua.random
+        h['User-Agent'] = random.choice(self.user_agents)
         request['headers'] = h
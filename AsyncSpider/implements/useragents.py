@@ -0,0 +1,35 @@
+# a bundled pool of common desktop user agents, so that no database is downloaded
+# built once at import from a few templates, a tuple for O(1) random.choice
+
+__all__ = ['USER_AGENTS']
+
+_WINDOWS = ('Windows NT 10.0; Win64; x64', 'Windows NT 10.0; WOW64', 'Windows NT 6.1; Win64; x64')
+_MAC = ('Macintosh; Intel Mac OS X 10_15_7', 'Macintosh; Intel Mac OS X 10_14_6', 'Macintosh; Intel Mac OS X 10_13_6')
+_LINUX = ('X11; Linux x86_64', 'X11; Ubuntu; Linux x86_64')
+
+_CHROME = ('118.0.0.0', '119.0.0.0', '120.0.0.0', '121.0.0.0', '122.0.0.0', '123.0.0.0', '124.0.0.0')
+_FIREFOX = ('115.0', '120.0', '121.0', '122.0', '123.0', '124.0')
+_SAFARI = ('15.6.1', '16.6', '17.2.1', '17.4')
+_EDGE = ('120.0.0.0', '122.0.0.0', '124.0.0.0')
+
+
+def _build():
+    agents = []
+    for platform in _WINDOWS + _MAC + _LINUX:
+        for v in _CHROME:
+            agents.append('Mozilla/5.0 ({}) AppleWebKit/537.36 (KHTML, like Gecko) '
+                          'Chrome/{} Safari/537.36'.format(platform, v))
+        for v in _FIREFOX:
+            agents.append('Mozilla/5.0 ({}; rv:{}) Gecko/20100101 Firefox/{}'.format(platform, v, v))
+    for platform in _MAC:
+        for v in _SAFARI:
+            agents.append('Mozilla/5.0 ({}) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+                          'Version/{} Safari/605.1.15'.format(platform, v))
+    for platform in _WINDOWS[:1] + _MAC[:1]:
+        for v in _EDGE:
+            agents.append('Mozilla/5.0 ({0}) AppleWebKit/537.36 (KHTML, like Gecko) '
+                          'Chrome/{1} Safari/537.36 Edg/{1}'.format(platform, v))
+    return tuple(agents)
+
+
+USER_AGENTS = _build()
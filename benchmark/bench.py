@@ -0,0 +1,336 @@
+""" Offline benchmarks of AsyncSpider against a local stand-in server.
+
+Usage:
+    python benchmark/bench.py --pages 2000 --latency 0.05 --body-size 32768 --charset gb18030 \
+        --status-mix 200:0.95,404:0.03,500:0.02 --output result.json
+
+Runs the fetcher, the saver and a full crawl, each in its own process so that its peak RSS is its own,
+and prints the results as json, so that runs of different releases can be compared.
+"""
+from AsyncSpider import Controller, Spider, ItemProcessor, Item, Field
+import AsyncSpider
+from aiohttp import web
+from asyncio import wrap_future
+from threading import Thread, Event
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+
+TEXT = 'AsyncSpider benchmark 蜘蛛 araña паук. '
+
+
+class StandInServer:
+    # an aiohttp server in its own thread, serving /page/{n}
+    # every response waits latency (+ uniform jitter) seconds,
+    # has a body of body_size bytes in charset, and a status drawn from status_mix
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, body_size=16384,
+                 charset='utf-8', charset_header=True, status_mix=None, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.charset = charset
+        self.charset_header = charset_header
+        self.status_mix = status_mix or {200: 1.0}
+        self._random = random.Random(seed)
+        self._body = self._make_body(body_size, charset)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = Event()
+
+    @staticmethod
+    def _make_body(size, charset):
+        head = '<html><head><meta charset="{}"><title>bench</title></head><body>'.format(charset).encode('ascii')
+        tail = b'</body></html>'
+        text = TEXT.encode(charset, errors='xmlcharrefreplace')
+        n = max(0, size - len(head) - len(tail))
+        return head + text * (n // len(text)) + b' ' * (n % len(text)) + tail
+
+    def _status(self):
+        r = self._random.random()
+        total = 0.0
+        for status, weight in self.status_mix.items():
+            total += weight
+            if r < total:
+                return status
+        return 200
+
+    async def _page(self, request):
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        ctype = 'text/html; charset={}'.format(self.charset) if self.charset_header else 'text/html'
+        return web.Response(body=self._body, status=self._status(), headers={'Content-Type': ctype})
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get('/page/{n}', self._page)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def url(self, n):
+        return 'http://{}:{}/page/{}'.format(self.host, self.port, n)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_kb():
+    # peak of the whole process, see run_isolated
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _run_child(conn, func, args):
+    AsyncSpider.logger.setLevel('WARNING')
+    try:
+        result = func(*args)
+    except Exception as exc:
+        result = exc
+    conn.send(result)
+    conn.close()
+
+
+def run_isolated(func, *args):
+    # runs a benchmark in a new process, so that peak_rss_kb is its own and not the peak of the ones before it
+    ctx = multiprocessing.get_context('spawn')
+    reader, writer = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_child, args=(writer, func, args))
+    proc.start()
+    writer.close()
+    try:
+        result = reader.recv()
+    except EOFError:
+        result = RuntimeError('{} exited without a result'.format(func.__name__))
+    proc.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def start_closable(executor) -> Event:
+    # starts executor, the returned event is set when it is closed,
+    # join asserts that the thread is alive, which it may not be after stop
+    closed = Event()
+    executor.call_on_closed(closed.set)
+    executor.start()
+    return closed
+
+
+def summary(count, elapsed, latencies=None, unit='pages'):
+    r = {unit: count, 'seconds': round(elapsed, 4),
+         '{}_per_sec'.format(unit): round(count / elapsed, 2) if elapsed else 0.0}
+    if latencies is not None:
+        r['p50_ms'] = round(percentile(latencies, 0.5) * 1000, 3)
+        r['p99_ms'] = round(percentile(latencies, 0.99) * 1000, 3)
+    r['peak_rss_kb'] = peak_rss_kb()
+    return r
+
+
+class BenchItem(Item):
+    url = Field()
+    status = Field()
+    size = Field()
+
+
+def bench_fetcher(url, settings, pages):
+    # concurrent fetches by the fetcher alone, at most settings['concurrency'] at a time
+    ctrl = Controller('bench_fetcher', settings)
+    fetcher = ctrl.fetcher
+    loop = asyncio.new_event_loop()
+    sem = asyncio.Semaphore(settings['concurrency'], loop=loop)
+    latencies = []
+    errors = 0
+
+    async def fetch(n):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                resp = await wrap_future(fetcher.run_coro_threadsafe(fetcher.fetch('get', url.format(n))), loop=loop)
+                resp.text(errors='replace')
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    closed = start_closable(fetcher)
+    try:
+        t0 = time.perf_counter()
+        loop.run_until_complete(asyncio.gather(*(fetch(n) for n in range(pages)), loop=loop))
+        elapsed = time.perf_counter() - t0
+    finally:
+        fetcher.stop()
+        closed.wait()
+        loop.close()
+    r = summary(pages, elapsed, latencies)
+    r['errors'] = errors
+    return r
+
+
+class NoopIP(ItemProcessor):
+    async def process(self, item):
+        pass
+
+
+def bench_saver(settings, items):
+    # items saved through a no-op item processor
+    ctrl = Controller('bench_saver', settings)
+    ctrl.construct(NoopIP)
+    saver = ctrl.saver
+    loop = asyncio.new_event_loop()
+
+    closed = start_closable(saver)
+    try:
+        t0 = time.perf_counter()
+        futures = [wrap_future(saver.run_coro_threadsafe(saver.save(BenchItem(url=str(n), status=200, size=0))),
+                               loop=loop)
+                   for n in range(items)]
+        loop.run_until_complete(asyncio.gather(*futures, loop=loop))
+        elapsed = time.perf_counter() - t0
+    finally:
+        saver.stop()
+        closed.wait()
+        loop.close()
+    return summary(items, elapsed, unit='items')
+
+
+class BenchSpider(Spider):
+    latencies = []
+
+    async def start_action(self):
+        server = self.settings['bench_server']
+        for n in self.partition(range(self.settings['bench_pages'])):
+            yield self.page(server.format(n))
+
+    async def page(self, url):
+        t0 = time.perf_counter()
+        resp = await self.fetch('get', url)
+        resp.text(errors='replace')
+        self.latencies.append(time.perf_counter() - t0)
+        yield BenchItem(url=url, status=resp.status, size=len(resp.content))
+
+
+class CountIP(ItemProcessor):
+    count = 0
+
+    async def process(self, item):
+        CountIP.count += 1
+
+
+def bench_crawl(url, settings, pages, single_loop=False):
+    # a full crawl by a controller, one item per page
+    BenchSpider.latencies = []
+    CountIP.count = 0
+    settings = dict(settings, bench_server=url, bench_pages=pages)
+    ctrl = Controller('bench_crawl', settings, single_loop=single_loop)
+    ctrl.construct(BenchSpider, CountIP)
+
+    t0 = time.perf_counter()
+    ctrl.run_all()
+    elapsed = time.perf_counter() - t0
+    r = summary(len(BenchSpider.latencies), elapsed, BenchSpider.latencies)
+    r['items'] = CountIP.count
+    r['items_per_sec'] = round(CountIP.count / elapsed, 2) if elapsed else 0.0
+    return r
+
+
+def parse_status_mix(text):
+    # '200:0.9,404:0.1' -> {200: 0.9, 404: 0.1}
+    mix = {}
+    for part in text.split(','):
+        status, weight = part.split(':')
+        mix[int(status)] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of AsyncSpider.')
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds of every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max extra seconds of every response')
+    parser.add_argument('--body-size', type=int, default=16384)
+    parser.add_argument('--charset', default='utf-8')
+    parser.add_argument('--no-charset-header', action='store_true',
+                        help='leave the charset out of Content-Type, so it is detected from the body')
+    parser.add_argument('--status-mix', type=parse_status_mix, default={200: 1.0})
+    parser.add_argument('--single-loop', action='store_true', help='crawl in single loop mode')
+    parser.add_argument('--only', choices=['fetcher', 'saver', 'crawl'], action='append',
+                        help='run only these benchmarks, can be repeated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the json report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    AsyncSpider.logger.setLevel('WARNING')
+    server = StandInServer(latency=args.latency, jitter=args.jitter, body_size=args.body_size,
+                           charset=args.charset, charset_header=not args.no_charset_header,
+                           status_mix=args.status_mix, seed=args.seed)
+    settings = {'concurrency': args.concurrency, 'conn_limit': args.concurrency}
+    only = set(args.only or ('fetcher', 'saver', 'crawl'))
+
+    results = {}
+    server.start()
+    try:
+        url = server.url('{}')
+        if 'fetcher' in only:
+            results['fetcher'] = run_isolated(bench_fetcher, url, settings, args.pages)
+        if 'saver' in only:
+            results['saver'] = run_isolated(bench_saver, settings, args.items)
+        if 'crawl' in only:
+            results['crawl'] = run_isolated(bench_crawl, url, settings, args.pages, args.single_loop)
+    finally:
+        server.stop()
+
+    config = vars(args).copy()
+    config['status_mix'] = {str(k): v for k, v in args.status_mix.items()}
+    report = {
+        'version': AsyncSpider.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': config,
+        'results': results,
+        # the process of the stand-in server, the peak of each benchmark is in its results
+        'server_peak_rss_kb': peak_rss_kb(),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
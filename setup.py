@@ -25,9 +25,8 @@ if __name__ == '__main__':
             'Programming Language :: Python :: 3.6',
         ],
         install_requires=[
-            'aiohttp',
+            'aiohttp>=3.3',
             'chardet',
-            'fake_useragent',
         ],
         license='Apache License',
         packages=find_packages(),
@@ -0,0 +1,88 @@
+from AsyncSpider import Item, Field
+from AsyncSpider.core import ItemBatch, batch as batch_module
+import io
+import json
+
+
+class Product(Item):
+    name = Field(type=str)
+    price = Field(type=float)
+    stock = Field(type=int)
+    sale = Field(type=bool)
+
+
+def products():
+    return [Product(name='a', price=10.0, stock=1, sale=False),
+            Product(name='b', price=200.0, stock=2, sale=True),
+            Product(name='c', price=300.0, stock=3, sale=False)]
+
+
+def typed_test():
+    # columns of int, float and bool are typed arrays only if every value is of the type
+    np = batch_module._numpy()
+    batch = ItemBatch.from_items(products())
+    assert (batch['price'].dtype, batch['stock'].dtype, batch['sale'].dtype) == \
+           (np.dtype('float64'), np.dtype('int64'), np.dtype('bool'))
+    assert batch['name'].dtype == object
+
+    # nothing is converted, e.g. 1.9 to 1, True to 1, 'no' to True, or None to nan
+    items = products()
+    items[0]['stock'] = 1.9
+    items[1]['sale'] = 'no'
+    items[2]['price'] = 300
+    del items[0]['price']
+    items.append(Product(name='d', stock=True))
+    mixed = ItemBatch.from_items(items)
+    for key in ('price', 'stock', 'sale'):
+        assert mixed[key].dtype == object, key
+    assert mixed.to_dicts()[0] == {'name': 'a', 'stock': 1.9, 'sale': False}
+    assert [type(item.get('stock')) for item in mixed.to_items()] == [float, int, int, bool]
+
+    # vectorized
+    batch = batch.filter(batch['price'] > 100)
+    batch['price'] = batch['price'] * 0.5
+    assert batch.to_dicts() == [{'name': 'b', 'price': 100.0, 'stock': 2, 'sale': True},
+                                {'name': 'c', 'price': 150.0, 'stock': 3, 'sale': False}]
+    # values are python objects again
+    assert all(type(item['stock']) is int for item in batch.to_items())
+
+
+def common_test():
+    # with or without numpy
+    batch = ItemBatch.from_items(products())
+    assert len(batch) == 3 and list(batch.keys()) == ['name', 'price', 'stock', 'sale']
+    assert [row[0] for row in batch.take([2, 0]).rows()] == ['c', 'a']
+    assert [item['name'] for item in batch.filter(lambda b: b['sale'])] == ['b']
+    both = ItemBatch.concat([batch, batch.take([1])])
+    assert len(both) == 4 and [item['name'] for item in both] == ['a', 'b', 'c', 'b']
+
+    f = io.StringIO()
+    batch.to_jsonl(f)
+    assert [json.loads(line) for line in f.getvalue().splitlines()] == batch.to_dicts()
+    f = io.StringIO()
+    batch.to_csv(f)
+    assert f.getvalue().splitlines()[:2] == ['name,price,stock,sale', 'a,10.0,1,False']
+
+    try:
+        ItemBatch(Product, {'name': ['a'], 'price': [1.0, 2.0]})
+    except ValueError:
+        pass
+    else:
+        assert False, 'columns of different lengths are accepted'
+
+
+if __name__ == '__main__':
+    if batch_module._numpy() is None:
+        print('numpy is not installed, typed columns are not tested')
+    else:
+        typed_test()
+        common_test()
+    # without numpy, columns are lists
+    numpy = batch_module._numpy
+    batch_module._numpy = lambda: None
+    try:
+        assert isinstance(ItemBatch.from_items(products())['price'], list)
+        common_test()
+    finally:
+        batch_module._numpy = numpy
+    print('ok')
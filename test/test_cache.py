@@ -0,0 +1,121 @@
+from AsyncSpider.core import HttpCache
+from AsyncSpider.core.reqrep import Request, Response
+from multidict import CIMultiDict, CIMultiDictProxy
+import asyncio
+import os
+import tempfile
+
+
+class Origin:
+    # answers 200 with an ETag, or 304 if the request has the ETag in If-None-Match
+    def __init__(self, headers=None, size=100):
+        self.requests = []
+        self.headers = dict(headers or {}, ETag='"v1"')
+        self.size = size
+
+    async def send(self, request):
+        self.requests.append(request)
+        if (request.get('headers') or {}).get('If-None-Match') == self.headers['ETag']:
+            status, content = 304, b''
+        else:
+            status, content = 200, b'x' * self.size
+        return Response(method=request['method'], url=request['url'], status=status, content=content,
+                        headers=CIMultiDictProxy(CIMultiDict(self.headers)), cookies={},
+                        host='example.com', history=())
+
+
+def request(path, **kwargs):
+    return Request('GET', 'http://example.com' + path, **kwargs)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro(loop))
+    finally:
+        loop.close()
+
+
+async def hit_test(loop):
+    with tempfile.TemporaryDirectory() as root:
+        origin = Origin()
+        cache = HttpCache(root, loop)
+        assert (await cache.fetch(request('/a'), origin.send)).status == 200
+        resp = await cache.fetch(request('/a'), origin.send)
+        assert resp.status == 200 and resp.content == b'x' * 100
+        assert len(origin.requests) == 1
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+async def revalidate_test(loop):
+    with tempfile.TemporaryDirectory() as root:
+        origin = Origin()
+        cache = HttpCache(root, loop, ttl=0)
+        await cache.fetch(request('/a'), origin.send)
+        # stale, the 304 is served from the cache
+        resp = await cache.fetch(request('/a'), origin.send)
+        assert resp.status == 200 and resp.content == b'x' * 100
+        assert origin.requests[-1]['headers']['If-None-Match'] == '"v1"'
+        assert cache.stats()['revalidated'] == 1 and cache.stats()['hits'] == 0
+
+
+async def evict_test(loop):
+    with tempfile.TemporaryDirectory() as root:
+        origin = Origin(size=1000)
+        cache = HttpCache(root, loop, max_size=2500)
+        for path in ('/a', '/b', '/c'):
+            await cache.fetch(request(path), origin.send)
+        # /a is used, so /b is the least recently used one
+        await cache.fetch(request('/a'), origin.send)
+        await cache.fetch(request('/d'), origin.send)
+        assert cache.stats()['entries'] == 2 and cache.stats()['size'] <= 2500
+        n = len(origin.requests)
+        await cache.fetch(request('/a'), origin.send)
+        assert len(origin.requests) == n
+        await cache.fetch(request('/b'), origin.send)
+        assert len(origin.requests) == n + 1
+
+
+async def cache_control_test(loop):
+    with tempfile.TemporaryDirectory() as root:
+        cache = HttpCache(root, loop)
+        origin = Origin({'Cache-Control': 'no-store'})
+        await cache.fetch(request('/a'), origin.send)
+        await cache.fetch(request('/a'), origin.send)
+        assert len(origin.requests) == 2 and cache.stats()['entries'] == 0
+
+        # no-cache of the response is stored, but revalidated even if fresh
+        origin = Origin({'Cache-Control': 'no-cache'})
+        await cache.fetch(request('/b'), origin.send)
+        assert (await cache.fetch(request('/b'), origin.send)).status == 200
+        assert len(origin.requests) == 2 and cache.stats()['revalidated'] == 1
+
+        # no-cache or no-store of the request
+        origin = Origin()
+        await cache.fetch(request('/c'), origin.send)
+        await cache.fetch(request('/c', headers={'Cache-Control': 'no-cache'}), origin.send)
+        assert origin.requests[-1]['headers']['If-None-Match'] == '"v1"'
+        await cache.fetch(request('/d', headers={'cache-control': 'no-store'}), origin.send)
+        assert cache.stats()['entries'] == 2
+
+
+async def reopen_test(loop):
+    with tempfile.TemporaryDirectory() as root:
+        origin = Origin()
+        await HttpCache(root, loop).fetch(request('/a'), origin.send)
+        # a write interrupted before its rename
+        tmp = os.path.join(root, 'zz', 'zz.tmp')
+        os.makedirs(os.path.dirname(tmp))
+        with open(tmp, 'wb') as f:
+            f.write(b'x' * 10)
+
+        cache = HttpCache(root, loop)
+        assert (await cache.fetch(request('/a'), origin.send)).status == 200
+        assert len(origin.requests) == 1 and cache.stats()['entries'] == 1
+        assert not os.path.exists(tmp)
+
+
+if __name__ == '__main__':
+    for test in (hit_test, revalidate_test, evict_test, cache_control_test, reopen_test):
+        run(test)
+        print(test.__name__, 'ok')
@@ -0,0 +1,79 @@
+from AsyncSpider import Controller, Request
+from AsyncSpider.core import BloomFilter
+from AsyncSpider.exceptions import DropRequest
+from AsyncSpider.implements import DupeFilterRP
+import asyncio
+import os
+
+
+def fingerprint_test():
+    def fp(method, url, **kwargs):
+        return Request(method, url, **kwargs).fingerprint()
+
+    base = fp('GET', 'http://example.com/a?x=1&y=2')
+    # case of scheme, host and method, default port, fragment, and order of the query do not matter
+    assert fp('get', 'HTTP://Example.COM:80/a?y=2&x=1#top') == base
+    # params are merged into the query
+    assert fp('GET', 'http://example.com/a?y=2', params={'x': 1}) == base
+    assert fp('GET', 'http://example.com/a', params=[('y', '2'), ('x', '1')]) == base
+    # path case, other ports, methods, queries and bodies do
+    assert fp('GET', 'http://example.com/A?x=1&y=2') != base
+    assert fp('GET', 'http://example.com:8080/a?x=1&y=2') != base
+    assert fp('POST', 'http://example.com/a?x=1&y=2') != base
+    assert fp('GET', 'http://example.com/a?x=1&y=3') != base
+    assert fp('GET', 'http://example.com/a?x=1&y=2&y=2') != base
+
+    post = fp('POST', 'http://example.com/', data={'a': 1, 'b': 2})
+    assert fp('POST', 'http://example.com/', data={'b': 2, 'a': 1}) == post
+    assert fp('POST', 'http://example.com/', data='a=1&b=2') == post
+    assert fp('POST', 'http://example.com/', json={'a': 1}) == fp('POST', 'http://example.com/', json={'a': 1})
+    assert fp('POST', 'http://example.com/', json={'a': 1}) != fp('POST', 'http://example.com/', json={'a': 2})
+
+
+def dupefilter_test(kind):
+    ctrl = Controller('test_dupefilter', {'dupefilter': kind, 'dupefilter_capacity': 1000})
+    f = ctrl.fetcher
+    rp = DupeFilterRP(f)
+    loop = asyncio.new_event_loop()
+    dropped = []
+
+    async def process(url):
+        try:
+            await rp.process(Request('GET', url))
+        except DropRequest:
+            dropped.append(url)
+
+    try:
+        for url in ('http://a.com/1', 'http://a.com/2', 'http://A.com/1', 'http://a.com/1#x', 'http://a.com/3'):
+            loop.run_until_complete(process(url))
+    finally:
+        loop.close()
+    assert dropped == ['http://A.com/1', 'http://a.com/1#x'], dropped
+    rp.on_stop()
+    assert f.runtime_data['dupefilter'] == {'hits': 2, 'misses': 3}
+
+
+def bloom_test():
+    # no false negatives, and about error_rate false positives at capacity
+    bloom = BloomFilter(10000, 0.01)
+    keys = [os.urandom(20) for _ in range(10000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert len(bloom) >= 9900
+    positives = sum(os.urandom(20) in bloom for _ in range(10000))
+    assert positives < 300, positives
+
+
+if __name__ == '__main__':
+    fingerprint_test()
+    for kind in ('set', 'bloom'):
+        dupefilter_test(kind)
+    bloom_test()
+    try:
+        Controller('test_dupefilter', {'dupefilter': 'list'}).construct(DupeFilterRP)
+    except ValueError:
+        pass
+    else:
+        assert False, 'unknown dupefilter is accepted'
+    print('ok')
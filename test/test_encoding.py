@@ -0,0 +1,109 @@
+from AsyncSpider.core import reqrep
+from AsyncSpider.core.reqrep import Response
+from multidict import CIMultiDict, CIMultiDictProxy
+import codecs
+import sys
+import types
+
+TEXT = '中文网页的内容，' * 50
+
+
+def response(content, host, content_type='text/html'):
+    return Response(method='GET', url='http://{}/'.format(host), status=200, content=content,
+                    headers=CIMultiDictProxy(CIMultiDict({'Content-Type': content_type})), cookies={},
+                    host=host, history=())
+
+
+class Chardet:
+    # counts detections, and detects what it is told to
+    def __init__(self, encoding):
+        self.calls = 0
+        self.encoding = encoding
+
+    def detect(self, data):
+        self.calls += 1
+        return {'encoding': self.encoding}
+
+
+def with_chardet(encoding):
+    chardet = Chardet(encoding)
+    sys.modules['chardet'] = types.SimpleNamespace(detect=chardet.detect)
+    return chardet
+
+
+def bom_test():
+    assert response(codecs.BOM_UTF8 + TEXT.encode(), 'bom').encoding == 'utf-8-sig'
+    assert response(codecs.BOM_UTF16_LE + TEXT.encode('utf-16-le'), 'bom').encoding == 'utf-16'
+    # the charset of Content-Type comes first
+    assert response('中文'.encode('big5'), 'bom', 'text/html; charset=big5').encoding == 'big5'
+    assert 'bom' not in reqrep._host_encodings
+
+
+def meta_test():
+    chardet = with_chardet(None)
+    page = b'<html><head><meta charset="gb2312"></head>' + TEXT.encode('gb2312')
+    # decoded with the superset
+    assert response(page, 'meta').encoding == 'gb18030'
+    assert chardet.calls == 0
+
+    # a page of the host without <meta> uses the cached encoding, chardet is not called
+    assert response(TEXT.encode('gb2312'), 'meta').encoding == 'gb18030'
+    assert chardet.calls == 0
+
+
+def fallback_test():
+    # detected, and cached for the host
+    chardet = with_chardet('SHIFT_JIS')
+    page = 'ページの内容'.encode('shift_jis') * 20
+    assert response(page, 'jp').encoding == 'SHIFT_JIS'
+    assert response(page, 'jp').encoding == 'SHIFT_JIS'
+    assert chardet.calls == 1
+
+    # the cached encoding cannot decode it, detected again
+    chardet = with_chardet('EUC-KR')
+    page = '한국어 내용'.encode('euc_kr') * 20
+    assert response(page, 'jp').encoding == 'EUC-KR'
+    assert chardet.calls == 1 and reqrep._host_encodings['jp'] == 'EUC-KR'
+
+
+def single_byte_test():
+    # latin-1 decodes anything, it would never be rejected, so it is not cached
+    chardet = with_chardet('ISO-8859-1')
+    page = 'café crème'.encode('latin-1') * 20
+    assert response(page, 'latin').encoding == 'ISO-8859-1'
+    assert 'latin' not in reqrep._host_encodings
+    chardet.encoding = 'utf-8'
+    assert response(TEXT.encode(), 'latin').encoding == 'utf-8'
+    assert chardet.calls == 2
+
+    # declared single-byte encodings are not cached either
+    page = b'<meta charset="iso-8859-1">' + 'café'.encode('latin-1')
+    assert response(page, 'latin2').encoding == 'iso8859-1'
+    assert 'latin2' not in reqrep._host_encodings
+
+
+def bound_test():
+    with_chardet('utf-8')
+    size = reqrep._HOST_CACHE_SIZE
+    reqrep._HOST_CACHE_SIZE = 3
+    try:
+        for host in ('a', 'b', 'c'):
+            response(TEXT.encode(), host).encoding
+        # a is used, so b is the least recently used one
+        response(TEXT.encode(), 'a').encoding
+        response(TEXT.encode(), 'd').encoding
+        assert list(reqrep._host_encodings)[-3:] == ['c', 'a', 'd']
+        assert len(reqrep._host_encodings) == 3
+    finally:
+        reqrep._HOST_CACHE_SIZE = size
+
+
+if __name__ == '__main__':
+    chardet = sys.modules.get('chardet')
+    try:
+        for test in (bom_test, meta_test, fallback_test, single_byte_test, bound_test):
+            test()
+            print(test.__name__, 'ok')
+    finally:
+        if chardet is not None:
+            sys.modules['chardet'] = chardet
@@ -0,0 +1,74 @@
+from AsyncSpider import Controller, Item, Field
+from AsyncSpider.implements import FeedExportIP
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+
+
+class Row(Item):
+    number = Field(type=int)
+    text = Field(type=str)
+    tags = Field()
+
+
+def save(settings, num):
+    ctrl = Controller('test_feed', dict(settings, feed_buffer_size=64))
+    ctrl.construct(FeedExportIP)
+    sav = ctrl.saver
+    sav.start()
+    try:
+        for n in range(num):
+            item = Row(number=n, tags=['t{}'.format(n)])
+            if n % 3:
+                item['text'] = '文本 {}'.format(n)
+            sav.run_coro_threadsafe(sav.save(item)).result(10)
+    finally:
+        sav.stop()
+        sav.join()
+    return ctrl.runtime_data['feed']
+
+
+def jsonl_test(root):
+    # rotated by items, files are numbered by index
+    path = os.path.join(root, 'feed.{shard}.{index}.jsonl')
+    assert save({'feed_path': path, 'feed_max_items': 4}, 10) == {'items': 10, 'files': 3}
+    rows = []
+    for index, count in enumerate((4, 4, 2)):
+        with open(path.format(shard=0, index=index), encoding='utf8') as f:
+            lines = [json.loads(line) for line in f]
+        assert len(lines) == count
+        rows.extend(lines)
+    assert [row['number'] for row in rows] == list(range(10))
+    assert rows[1] == {'number': 1, 'text': '文本 1', 'tags': ['t1']}
+    assert 'text' not in rows[0]
+
+
+def csv_gzip_test(root):
+    # rotated by bytes before compression, every file has a header
+    path = os.path.join(root, 'feed.{index}.csv')
+    stats = save({'feed_path': path, 'feed_max_bytes': 100, 'feed_gzip': True}, 20)
+    assert stats['items'] == 20 and stats['files'] > 2
+    assert sorted(os.listdir(root)) == ['feed.{}.csv.gz'.format(i) for i in range(stats['files'])]
+    numbers = []
+    for index in range(stats['files']):
+        with gzip.open(path.format(index=index) + '.gz', 'rb') as f:
+            data = f.read()
+        # the size which triggers rotation may be exceeded by the last item only
+        assert index == stats['files'] - 1 or len(data) < 100 + 40
+        reader = csv.reader(io.StringIO(data.decode('utf8')))
+        assert next(reader) == ['number', 'text', 'tags']
+        for number, text, tags in reader:
+            numbers.append(int(number))
+            assert text == ('' if int(number) % 3 == 0 else '文本 {}'.format(number))
+    assert numbers == list(range(20))
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as root:
+        jsonl_test(root)
+    with tempfile.TemporaryDirectory() as root:
+        csv_gzip_test(root)
+    print('ok')
@@ -0,0 +1,85 @@
+from AsyncSpider import Controller, Spider, Item, Field, ItemProcessor
+from threading import Thread
+
+
+class TestItem(Item):
+    number = Field()
+
+
+class CountProcessor(ItemProcessor):
+    count = 0
+
+    async def process(self, item):
+        CountProcessor.count += 1
+
+
+class YieldSpider(Spider):
+    # every action yields children, deeper than the frontier is long
+    async def start_action(self):
+        for i in range(10):
+            yield self.branch(i, 3)
+
+    async def branch(self, number, depth):
+        if depth == 0:
+            yield TestItem(number=number)
+            return
+        for _ in range(2):
+            yield self.branch(number, depth - 1)
+
+
+class AddActionSpider(Spider):
+    # every action adds its children by add_action instead of yielding them
+    async def start_action(self):
+        for i in range(10):
+            await self.add_action(self.branch(i, 3))
+        yield
+
+    async def branch(self, number, depth):
+        if depth == 0:
+            yield TestItem(number=number)
+            return
+        for _ in range(2):
+            await self.add_action(self.branch(number, depth - 1))
+
+
+class ChainSpider(Spider):
+    # a pagination chain much deeper than the stack allows, driven in place behind a full frontier
+    async def start_action(self):
+        yield self.idle()
+        yield self.page(0)
+
+    async def idle(self):
+        yield
+
+    async def page(self, number):
+        yield TestItem(number=number)
+        if number + 1 < 2000:
+            yield self.page(number + 1)
+
+
+def run(spider_class, settings, timeout=30):
+    # returns the number of saved items, fails if the crawl does not finish in time
+    CountProcessor.count = 0
+    ctrl = Controller('test_frontier', settings)
+    ctrl.construct(spider_class, CountProcessor)
+    t = Thread(target=ctrl.run_all, daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), '{} {} did not finish'.format(spider_class.__name__, settings)
+    return CountProcessor.count
+
+
+if __name__ == '__main__':
+    for frontier in ('fifo', 'priority'):
+        for cls in (YieldSpider, AddActionSpider):
+            for settings in ({'concurrency': 2, 'frontier_size': 2},
+                             {'concurrency': 1, 'frontier_size': 1},
+                             {'concurrency': 4, 'frontier_size': 0}):
+                settings = dict(settings, frontier=frontier)
+                count = run(cls, settings)
+                print(cls.__name__, settings, 'items:', count)
+                assert count == 80
+
+    count = run(ChainSpider, {'concurrency': 1, 'frontier_size': 1})
+    print('ChainSpider items:', count)
+    assert count == 2000
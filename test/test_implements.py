@@ -0,0 +1,57 @@
+from AsyncSpider import Controller, Request
+from AsyncSpider.implements import RandomUserAgentRP
+from AsyncSpider.implements.useragents import USER_AGENTS
+import asyncio
+import subprocess
+import sys
+
+# run in a new interpreter: the import must not touch the network, import optional or slow packages,
+# or configure logging
+IMPORT_SCRIPT = '''
+import socket, sys
+
+def offline(*args, **kwargs):
+    raise AssertionError('network used on import')
+
+socket.socket.connect = socket.create_connection = socket.getaddrinfo = offline
+before = set(sys.modules)
+import AsyncSpider.implements
+imported = set(sys.modules) - before
+assert not {'chardet', 'numpy', 'fake_useragent'} & imported, imported
+
+import logging
+assert not logging.getLogger('AsyncSpider').handlers and not logging.getLogger().handlers
+'''
+
+
+class FixedUserAgentRP(RandomUserAgentRP):
+    user_agents = ('agent/1',)
+
+
+def user_agent_test():
+    ctrl = Controller('test_implements')
+    loop = asyncio.new_event_loop()
+    try:
+        rp = RandomUserAgentRP(ctrl.fetcher)
+        agents = set()
+        for _ in range(200):
+            request = Request('GET', 'http://example.com/', headers={'Accept': 'text/html'})
+            loop.run_until_complete(rp.process(request))
+            # other headers are kept
+            assert request['headers']['Accept'] == 'text/html'
+            agents.add(request['headers']['User-Agent'])
+        assert agents <= set(USER_AGENTS) and len(agents) > 10
+
+        # a request without headers, and a subclass with its own pool
+        request = Request('GET', 'http://example.com/')
+        loop.run_until_complete(FixedUserAgentRP(ctrl.fetcher).process(request))
+        assert request['headers'] == {'User-Agent': 'agent/1'}
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    assert len(USER_AGENTS) == len(set(USER_AGENTS)) and all(a.startswith('Mozilla/5.0 (') for a in USER_AGENTS)
+    user_agent_test()
+    subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], check=True, timeout=60)
+    print('ok')
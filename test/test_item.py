@@ -1,4 +1,6 @@
 from AsyncSpider import Item, Field
+import copy
+import pickle
 
 
 class TestItem(Item):
@@ -8,7 +10,53 @@ class TestItem(Item):
     count = Field(type=int, default=0)
 
 
+class SubItem(TestItem):
+    url = Field(type=str, default='')
+
+
+def storage_test():
+    # defaults are set, other keys are unset until assigned
+    t = TestItem(title='a')
+    assert len(t) == 3 and dict(t) == {'title': 'a', 'is_valid': False, 'count': 0}
+    assert 'content' not in t and t.get('content') is None
+    t['content'] = None
+    assert len(t) == 4 and 'content' in t
+    del t['title']
+    assert len(t) == 3 and list(t) == ['content', 'is_valid', 'count']
+    assert t.to_tuple('-') == ('-', None, False, 0)
+    t.clear()
+    assert len(t) == 0 and not hasattr(t, '__dict__')
+    try:
+        t['no_such_key'] = 1
+    except KeyError:
+        pass
+    else:
+        assert False, 'undefined key is set'
+
+    # subclasses have the keys of their bases, and their own defaults
+    s = SubItem()
+    assert list(SubItem.all_keys()) == ['title', 'content', 'is_valid', 'count', 'url']
+    assert dict(s) == {'is_valid': False, 'count': 0, 'url': ''}
+
+
+def copy_test():
+    t = TestItem(title='a', content=['x'])
+    del t['count']
+    for c in (t.copy(), copy.copy(t), pickle.loads(pickle.dumps(t))):
+        # unset keys stay unset, not reset to their defaults
+        assert type(c) is TestItem and dict(c) == dict(t) and len(c) == 3 and 'count' not in c
+        c['title'] = 'b'
+        assert t['title'] == 'a'
+    # copies are shallow, deep copies are not
+    assert t.copy()['content'] is t['content']
+    d = copy.deepcopy(t)
+    assert d['content'] == t['content'] and d['content'] is not t['content']
+
+
 if __name__ == '__main__':
+    storage_test()
+    copy_test()
+
     t = TestItem(count=1)
     print(f't: {t}')
     t['title'] = 'Philosophy'
@@ -0,0 +1,69 @@
+from AsyncSpider import Controller, Spider, Item, Field, ItemProcessor
+import AsyncSpider
+from threading import Thread
+import os
+import tempfile
+
+
+class TestItem(Item):
+    number = Field()
+
+
+class CollectProcessor(ItemProcessor):
+    numbers = []
+
+    async def process(self, item):
+        CollectProcessor.numbers.append(item['number'])
+
+
+class ResumeSpider(Spider):
+    # stops itself at page stop_at, which is left pending in the frontier
+    stop_at = None
+
+    async def start_action(self):
+        for i in range(20):
+            yield self.page(i)
+
+    async def page(self, number):
+        if number == self.stop_at:
+            self.stop()
+            await AsyncSpider.sleep(3600)
+        yield TestItem(number=number)
+
+
+def run(path, stop_at=None, single_loop=False, timeout=30):
+    # returns the numbers of saved items, fails if the crawl does not finish in time
+    ResumeSpider.stop_at = stop_at
+    CollectProcessor.numbers = []
+    ctrl = Controller('test_persistent_frontier',
+                      {'concurrency': 1, 'frontier': 'persistent', 'frontier_path': path},
+                      single_loop=single_loop)
+    ctrl.construct(ResumeSpider, CollectProcessor)
+    t = Thread(target=ctrl.run_all, daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), 'crawl did not finish'
+    return sorted(CollectProcessor.numbers)
+
+
+def resume_test(single_loop):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'frontier.db')
+
+        first = run(path, stop_at=10, single_loop=single_loop)
+        print('first run:', first)
+        assert first == list(range(10))
+
+        resumed = run(path, single_loop=single_loop)
+        print('resumed run:', resumed)
+        assert resumed == list(range(10, 20))
+
+        # the crawl is complete, a rerun has nothing to do and must still stop
+        rerun = run(path, single_loop=single_loop)
+        print('rerun of a complete crawl:', rerun)
+        assert rerun == []
+
+
+if __name__ == '__main__':
+    resume_test(single_loop=False)
+    resume_test(single_loop=True)
@@ -0,0 +1,189 @@
+from AsyncSpider import Controller, Spider, Item, Field, ItemProcessor
+from AsyncSpider.exceptions import DropItem
+from asyncio import wrap_future
+from random import random
+import AsyncSpider
+import asyncio
+import logging
+import threading
+import time
+
+
+class TestItem(Item):
+    number = Field(type=int)
+
+
+class ShuffleProcessor(ItemProcessor):
+    # finishes items out of order, ordered keeps them in order for the next stage
+    concurrency = 8
+    ordered = True
+
+    async def process(self, item):
+        await AsyncSpider.sleep(random() * 0.02)
+
+
+class DropProcessor(ItemProcessor):
+    # drops multiples of 5, fails multiples of 7
+    async def process(self, item):
+        if item['number'] % 5 == 0:
+            raise DropItem(item['number'])
+        if item['number'] % 7 == 0:
+            raise ValueError(item['number'])
+
+
+class RecordProcessor(ItemProcessor):
+    numbers = []
+
+    async def process(self, item):
+        RecordProcessor.numbers.append(item['number'])
+
+
+class BatchRecordProcessor(ItemProcessor):
+    batch_size = 4
+    batch_delay = 0.05
+    batches = []
+
+    async def process_batch(self, items):
+        BatchRecordProcessor.batches.append([item['number'] for item in items])
+
+
+class DelayBatchProcessor(ItemProcessor):
+    # records (seconds since started, numbers) of every batch, fails batches with a multiple of 100
+    batch_size = 10
+    batch_delay = 0.3
+    started = 0.0
+    batches = []
+
+    async def process_batch(self, items):
+        numbers = [item['number'] for item in items]
+        DelayBatchProcessor.batches.append((time.monotonic() - DelayBatchProcessor.started, numbers))
+        if any(n % 100 == 0 for n in numbers):
+            raise ValueError(numbers)
+
+
+class SleepProcessor(ItemProcessor):
+    # an I/O bound processor without a concurrency, items are not limited
+    async def process(self, item):
+        await AsyncSpider.sleep(0.2)
+
+
+class StuckProcessor(ItemProcessor):
+    # a sink which does not finish before the drain deadline
+    async def process(self, item):
+        await AsyncSpider.sleep(60)
+
+
+class NumberSpider(Spider):
+    async def start_action(self):
+        for n in range(20):
+            yield TestItem(number=n)
+
+
+def run_saves(ctrl, num):
+    sav = ctrl.saver
+    loop = asyncio.new_event_loop()
+    results = {}
+
+    async def save(n):
+        try:
+            await wrap_future(sav.run_coro_threadsafe(sav.save(TestItem(number=n))), loop=loop)
+        except Exception as exc:
+            results[n] = exc
+        else:
+            results[n] = None
+
+    async def save_all():
+        await asyncio.gather(*(save(n) for n in range(1, num + 1)), loop=loop)
+
+    sav.start()
+    try:
+        loop.run_until_complete(save_all())
+    finally:
+        sav.stop()
+        loop.close()
+    return results
+
+
+def pipeline_test(num):
+    RecordProcessor.numbers = []
+    BatchRecordProcessor.batches = []
+    ctrl = Controller('test_pipeline', {'drain_timeout': 10})
+    ctrl.construct(ShuffleProcessor, DropProcessor, RecordProcessor, BatchRecordProcessor)
+    results = run_saves(ctrl, num)
+    return results, ctrl.saver.stage_stats()
+
+
+def batch_test(num):
+    DelayBatchProcessor.batches = []
+    ctrl = Controller('test_pipeline')
+    ctrl.construct(DelayBatchProcessor)
+    DelayBatchProcessor.started = time.monotonic()
+    results = run_saves(ctrl, num)
+    return results, DelayBatchProcessor.batches
+
+
+def throughput_test(num):
+    # returns seconds to save num items through SleepProcessor
+    ctrl = Controller('test_pipeline')
+    ctrl.construct(SleepProcessor)
+    t0 = time.monotonic()
+    results = run_saves(ctrl, num)
+    assert all(exc is None for exc in results.values())
+    return time.monotonic() - t0
+
+
+def drain_test(single_loop):
+    # stop_all(drain_timeout) returns, and the run finishes, soon after the deadline
+    ctrl = Controller('test_pipeline', {'concurrency': 2}, single_loop=single_loop)
+    ctrl.construct(NumberSpider, StuckProcessor)
+    t = threading.Thread(target=ctrl.run_all, daemon=True)
+    t.start()
+    time.sleep(0.3)
+    t0 = time.monotonic()
+    ctrl.stop_all(drain_timeout=0.5)
+    t.join(10)
+    assert not t.is_alive(), 'the drain did not end at its deadline'
+    assert time.monotonic() - t0 < 5
+    return ctrl.runtime_data['saver']['cancelled']
+
+
+if __name__ == '__main__':
+    # failures of DropProcessor are expected
+    AsyncSpider.logger.setLevel(logging.CRITICAL)
+    num = 200
+    results, stats = pipeline_test(num)
+    for st in stats:
+        print(st)
+
+    kept = [n for n in range(1, num + 1) if n % 5 and n % 7]
+    failed = [n for n in range(1, num + 1) if n % 5 and not n % 7]
+    print('recorded:', RecordProcessor.numbers[:20], '...')
+    assert RecordProcessor.numbers == kept, 'items are not in order'
+    assert [n for batch in BatchRecordProcessor.batches for n in batch] == kept
+    assert all(len(batch) <= 4 for batch in BatchRecordProcessor.batches)
+
+    # dropped items are saved without an error, failed items raise the error of their stage
+    assert all(results[n] is None for n in range(5, num + 1, 5))
+    assert sorted(n for n, exc in results.items() if isinstance(exc, ValueError)) == failed
+    drop = stats[1]
+    assert (drop['processed'], drop['dropped'], drop['failed']) == (len(kept), num // 5, len(failed))
+
+    # full batches are flushed at once, the rest after batch_delay, a failed batch fails all of its items
+    results, batches = batch_test(25)
+    print('batches:', [(round(t, 2), len(numbers)) for t, numbers in batches])
+    assert [len(numbers) for _, numbers in batches] == [10, 10, 5]
+    assert batches[1][0] < 0.2 and 0.25 <= batches[2][0] < 1.0
+    assert all(exc is None for exc in results.values())
+    results, batches = batch_test(100)
+    failed = next(numbers for _, numbers in batches if 100 in numbers)
+    assert sorted(n for n, exc in results.items() if isinstance(exc, ValueError)) == sorted(failed)
+
+    # by default items are processed concurrently, not one at a time
+    t = throughput_test(20)
+    print('20 items through a 0.2s processor: {:.2f}s'.format(t))
+    assert t < 1.0
+
+    for single_loop in (False, True):
+        cancelled = drain_test(single_loop)
+        print('cancelled by the drain deadline, single_loop={}: {}'.format(single_loop, cancelled))
+        assert cancelled > 0
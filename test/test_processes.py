@@ -0,0 +1,77 @@
+from AsyncSpider import Controller, Spider, Item, Field, Fetcher, Saver
+from AsyncSpider.core import Profiler
+from AsyncSpider.implements import CountItemIP
+from threading import Thread
+import os
+import tempfile
+
+
+class TestItem(Item):
+    number = Field()
+
+
+class PartSpider(Spider):
+    async def start_action(self):
+        for i in self.partition(range(40)):
+            yield TestItem(number=i)
+
+
+class StatSpider(PartSpider):
+    # writes a ratio, which must not be summed
+    async def start_action(self):
+        self.runtime_data['ratio'] = 0.5
+        async for obj in PartSpider.start_action(self):
+            yield obj
+
+
+def run(processes, central_saver, settings=None):
+    ctrl = Controller('test_processes', dict(settings or {}, concurrency=2))
+    ctrl.construct(StatSpider, CountItemIP)
+    t = Thread(target=ctrl.run_all_processes, args=(processes,), kwargs={'central_saver': central_saver},
+               daemon=True)
+    t.start()
+    t.join(60)
+    assert not t.is_alive(), 'run_all_processes did not finish'
+    return ctrl.runtime_data
+
+
+def merge_test():
+    # every component merges its own keys
+    dst = {}
+    shards = ({'hedge': {'eligible': 4, 'hedged': 2, 'wins': 1, 'win_rate': 0.5},
+               'profile': {'a': {'count': 1, 'wall': 1.0, 'fetch': 0.0, 'cpu': 0.5, 'max_wall': 1.0}},
+               'retry': {'retries': 1, 'gave_up': 0, 'breaker': None},
+               'saver': {'save_wait_time': 0.5, 'cancelled': 0,
+                         'stages': [{'processor': 'A', 'queued': 0, 'processed': 3, 'dropped': 0, 'failed': 0}]}},
+              {'hedge': {'eligible': 4, 'hedged': 2, 'wins': 0, 'win_rate': 0.0},
+               'profile': {'a': {'count': 2, 'wall': 3.0, 'fetch': 0.0, 'cpu': 1.0, 'max_wall': 3.0}},
+               'retry': {'retries': 2, 'gave_up': 1,
+                         'breaker': {'opened': 1, 'rejected': 2, 'open_hosts': ['x'], 'half_open': []}},
+               'saver': {'save_wait_time': 0.25, 'cancelled': 1,
+                         'stages': [{'processor': 'A', 'queued': 0, 'processed': 4, 'dropped': 1, 'failed': 0}]}})
+    for src in shards:
+        for cls in (Fetcher, Saver, Profiler):
+            cls.merge_runtime_data(dst, src)
+    assert dst['hedge'] == {'eligible': 8, 'hedged': 4, 'wins': 1, 'win_rate': 0.25}
+    assert dst['profile']['a'] == {'count': 3, 'wall': 4.0, 'fetch': 0.0, 'cpu': 1.5, 'max_wall': 3.0}
+    assert dst['retry'] == {'retries': 3, 'gave_up': 1,
+                            'breaker': {'opened': 1, 'rejected': 2, 'open_hosts': ['x'], 'half_open': []}}
+    assert dst['saver']['cancelled'] == 1 and dst['saver']['save_wait_time'] == 0.75
+    assert dst['saver']['stages'] == [{'processor': 'A', 'queued': 0, 'processed': 7, 'dropped': 1, 'failed': 0}]
+
+
+if __name__ == '__main__':
+    merge_test()
+
+    data = run(2, central_saver=True)
+    print('central saver:', data['item_count'], sorted(data['shards']))
+    assert data['item_count'] == 40 and sorted(data['shards']) == [0, 1]
+
+    with tempfile.TemporaryDirectory() as root:
+        data = run(2, central_saver=False, settings={'http_cache': root})
+        print('saver per process:', data['item_count'], data.get('ratio'))
+        assert data['item_count'] == 40
+        # not merged by any component, kept per process only
+        assert 'ratio' not in data and data['shards'][0]['ratio'] == 0.5
+        # a cache directory per process
+        assert sorted(os.listdir(root)) == ['0', '1']
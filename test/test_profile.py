@@ -0,0 +1,47 @@
+from AsyncSpider import Controller, Spider, Item, Field
+from threading import Thread
+import asyncio
+import time
+
+
+class TestItem(Item):
+    number = Field()
+
+
+class FetchSpider(Spider):
+    # every page waits 0.1s for the fetcher and spends about 0.05s on the cpu
+    async def start_action(self):
+        for i in range(4):
+            yield self.page(i)
+
+    async def page(self, number):
+        await self.fetch('get', 'http://example.com/{}'.format(number))
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < 0.05:
+            pass
+        yield TestItem(number=number)
+
+
+async def fake_fetch(method, url, **kwargs):
+    await asyncio.sleep(0.1)
+
+
+def run(single_loop):
+    ctrl = Controller('test_profile', {'concurrency': 2, 'profile': True}, single_loop=single_loop)
+    ctrl.construct(FetchSpider)
+    ctrl.fetcher.fetch = fake_fetch
+    t = Thread(target=ctrl.run_all, daemon=True)
+    t.start()
+    t.join(30)
+    assert not t.is_alive(), 'the crawl did not finish'
+    return ctrl.runtime_data['profile']
+
+
+if __name__ == '__main__':
+    for single_loop in (False, True):
+        profile = run(single_loop)
+        page = profile['FetchSpider.page']
+        print('single loop' if single_loop else 'threads', page)
+        assert page['count'] == 4
+        assert 0.35 < page['fetch'] < 0.6, 'fetch time is not profiled'
+        assert 0.15 < page['cpu'] < page['wall'] - page['fetch'] + 0.05
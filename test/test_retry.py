@@ -0,0 +1,181 @@
+from AsyncSpider import Controller, RequestProcessor
+from AsyncSpider.exceptions import CircuitOpenError
+from aiohttp import web
+from threading import Thread, Event
+import asyncio
+import time
+
+
+class TestServer:
+    # /ok is 200, /flaky/{n} is 500 for its first n requests, /busy is 429 with Retry-After: 1 once,
+    # /down is always 500, /slow/{n} takes 2 seconds for its first request only
+    def __init__(self):
+        self.hits = {}
+        self._loop = None
+        self._ready = Event()
+        self.port = None
+
+    def _hit(self, request):
+        path = request.path
+        self.hits[path] = self.hits.get(path, 0) + 1
+        return self.hits[path]
+
+    async def _ok(self, request):
+        self._hit(request)
+        return web.Response(text='ok')
+
+    async def _flaky(self, request):
+        n = self._hit(request)
+        return web.Response(text='flaky', status=500 if n <= int(request.match_info['n']) else 200)
+
+    async def _busy(self, request):
+        n = self._hit(request)
+        if n == 1:
+            return web.Response(text='busy', status=429, headers={'Retry-After': '1'})
+        return web.Response(text='ok')
+
+    async def _down(self, request):
+        self._hit(request)
+        return web.Response(text='down', status=500)
+
+    async def _slow(self, request):
+        if self._hit(request) == 1:
+            await asyncio.sleep(2)
+        return web.Response(text='slow')
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get('/ok', self._ok)
+        app.router.add_get('/flaky/{n}', self._flaky)
+        app.router.add_get('/busy', self._busy)
+        app.router.add_get('/down', self._down)
+        app.router.add_get('/slow/{n}', self._slow)
+        runner = web.AppRunner(app)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(runner.cleanup())
+        self._loop.close()
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def url(self, path, host='127.0.0.1'):
+        return 'http://{}:{}{}'.format(host, self.port, path)
+
+
+class OnceProcessor(RequestProcessor):
+    count = 0
+
+    async def process(self, request):
+        OnceProcessor.count += 1
+
+
+class ResendProcessor(RequestProcessor):
+    # like a rate limiter, sees every attempt
+    resend = True
+    count = 0
+
+    async def process(self, request):
+        ResendProcessor.count += 1
+
+
+def fetch(fetcher, url):
+    try:
+        return fetcher.run_coro_threadsafe(fetcher.fetch('get', url)).result(30)
+    except Exception as exc:
+        return exc
+
+
+if __name__ == '__main__':
+    server = TestServer()
+    server.start()
+    ctrl = Controller('test_retry', {'retry_times': 2, 'retry_backoff': 0.01,
+                                     'breaker_threshold': 2, 'breaker_cooldown': 0.5,
+                                     'hedge_delay': 0.5, 'hedge_budget': 1.0})
+    f = ctrl.fetcher
+    f.add_processor(OnceProcessor(f))
+    f.add_processor(ResendProcessor(f))
+    errors = []
+    f.loop.set_exception_handler(lambda loop, context: errors.append(context))
+    f.start()
+    try:
+        # retried until it succeeds, every retry goes through the resend processors only
+        resp = fetch(f, server.url('/flaky/2'))
+        assert resp.status == 200, resp
+        assert server.hits['/flaky/2'] == 3
+        assert (OnceProcessor.count, ResendProcessor.count) == (1, 3)
+
+        # Retry-After is waited for instead of the backoff
+        t0 = time.monotonic()
+        resp = fetch(f, server.url('/busy'))
+        assert resp.status == 200 and server.hits['/busy'] == 2
+        assert time.monotonic() - t0 >= 0.9
+
+        # a failed request is counted once by the breaker, not once per attempt
+        resp = fetch(f, server.url('/down'))
+        assert resp.status == 500 and server.hits['/down'] == 3
+        assert not f.retry_stats()['breaker']['open_hosts']
+        resp = fetch(f, server.url('/down'))
+        assert resp.status == 500 and server.hits['/down'] == 6
+        assert f.retry_stats()['breaker']['open_hosts'] == ['127.0.0.1']
+
+        # the open host is rejected without requests, other hosts are not
+        exc = fetch(f, server.url('/ok'))
+        assert isinstance(exc, CircuitOpenError), exc
+        assert '/ok' not in server.hits
+        assert fetch(f, server.url('/ok', 'localhost')).status == 200
+
+        # after the cooldown one probe is let through, its failure opens the host again at once
+        time.sleep(0.6)
+        hits = server.hits['/down']
+        assert fetch(f, server.url('/down')).status == 500
+        assert server.hits['/down'] == hits + 3
+        assert f.retry_stats()['breaker']['open_hosts'] == ['127.0.0.1']
+        assert isinstance(fetch(f, server.url('/ok')), CircuitOpenError)
+
+        # while the probe is in flight, other requests are rejected, and its success closes the host
+        time.sleep(0.6)
+        probe = f.run_coro_threadsafe(f.fetch('get', server.url('/slow/1')))
+        time.sleep(0.1)
+        assert f.retry_stats()['breaker']['half_open'] == ['127.0.0.1']
+        assert isinstance(fetch(f, server.url('/ok')), CircuitOpenError)
+        assert probe.result(30).status == 200
+        assert fetch(f, server.url('/ok')).status == 200
+        assert fetch(f, server.url('/down')).status == 500
+        assert not f.retry_stats()['breaker']['open_hosts']
+
+        # the hedge goes through the resend processors, and wins
+        OnceProcessor.count = ResendProcessor.count = 0
+        wins = f.hedge_stats()['wins']
+        t0 = time.monotonic()
+        resp = fetch(f, server.url('/slow/2'))
+        assert resp.status == 200 and time.monotonic() - t0 < 1.5
+        assert (OnceProcessor.count, ResendProcessor.count) == (1, 2)
+        assert f.hedge_stats()['wins'] == wins + 1
+        print(f.retry_stats(), f.hedge_stats())
+
+        # idle connections of the pool, read in the fetcher's loop, and collected as metrics
+        host = '127.0.0.1:{}'.format(server.port)
+        assert f.run_coro_threadsafe(f.pool_stats()).result(10)[host]['idle'] >= 1
+        ctrl.metrics.snapshot()
+        time.sleep(0.1)
+        gauges = ctrl.metrics.snapshot()['gauges']
+        assert dict((labels['host'], v) for labels, v in gauges['fetch_pool_idle'])[host] >= 1
+    finally:
+        closed = Event()
+        f.call_on_closed(closed.set)
+        f.stop()
+        closed.wait(10)
+        server.stop()
+    # e.g. Task exception was never retrieved
+    assert not errors, errors
@@ -0,0 +1,69 @@
+from AsyncSpider.core.base import ThreadSafeSemaphore
+from threading import Thread
+import asyncio
+import time
+
+
+class LoopThread:
+    # an event loop running in its own thread
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+        self.loop.close()
+
+
+def wait_until(pred, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not pred():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    a, b = LoopThread(), LoopThread()
+    try:
+        sem = ThreadSafeSemaphore(1)
+        order = []
+
+        async def acquire(name):
+            await sem.acquire(asyncio.get_event_loop())
+            order.append(name)
+
+        # a free slot is taken without waiting
+        a.submit(acquire('a0')).result(5)
+        assert (sem.waiting, sem.wait_time) == (0, 0.0)
+
+        # waiters on both loops are counted, and woken in FIFO order, one per release from any thread
+        futures = []
+        for name, lt in (('b1', b), ('a2', a), ('b3', b)):
+            futures.append(lt.submit(acquire(name)))
+            wait_until(lambda: sem.waiting == len(futures))
+        time.sleep(0.2)
+        for n, fut in enumerate(futures):
+            sem.release()
+            fut.result(5)
+            assert sem.waiting == len(futures) - n - 1
+        assert order == ['a0', 'b1', 'a2', 'b3'], order
+        # the three waiters waited at least 0.2 seconds each
+        assert sem.wait_time >= 0.6, sem.wait_time
+
+        # a cancelled waiter is not counted and does not take the slot
+        fut = a.submit(acquire('cancelled'))
+        wait_until(lambda: sem.waiting == 1)
+        fut.cancel()
+        wait_until(lambda: sem.waiting == 0)
+        sem.release()
+        b.submit(acquire('b4')).result(5)
+        assert order[-1] == 'b4'
+        print('wait time:', round(sem.wait_time, 2))
+    finally:
+        a.close()
+        b.close()
@@ -0,0 +1,51 @@
+from AsyncSpider import Controller, Item, Field
+from AsyncSpider.implements import SqliteIP
+import os
+import sqlite3
+import tempfile
+
+
+class Page(Item):
+    url = Field(type=str, key=True)
+    title = Field(type=str)
+    size = Field(type=int)
+
+
+def save(path, *items):
+    ctrl = Controller('test_sqlite', {'sqlite_path': path})
+    ctrl.construct(SqliteIP)
+    sav = ctrl.saver
+    sav.start()
+    try:
+        for item in items:
+            sav.run_coro_threadsafe(sav.save(item)).result(10)
+    finally:
+        sav.stop()
+        sav.join()
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return sorted(db.execute('SELECT url, title, size FROM Page'))
+
+
+def upsert_test(path):
+    save(path, Page(url='a', title='A', size=1), Page(url='b', title='B'))
+    # unset keys keep their stored values, set keys are updated, even to None
+    save(path, Page(url='a', size=2), Page(url='b', size=None), Page(url='c', title='C'), Page(url='a'))
+    assert rows(path) == [('a', 'A', 2), ('b', 'B', None), ('c', 'C', None)], rows(path)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as root:
+        upsert_test(os.path.join(root, 'items.db'))
+        print('upsert ok')
+
+        # sqlite older than 3.24 has no upsert, the row is updated or inserted instead
+        version = sqlite3.sqlite_version_info
+        sqlite3.sqlite_version_info = (3, 23, 0)
+        try:
+            upsert_test(os.path.join(root, 'old.db'))
+        finally:
+            sqlite3.sqlite_version_info = version
+        print('update or insert ok')
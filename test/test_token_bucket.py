@@ -0,0 +1,65 @@
+from AsyncSpider.implements import TokenBucket
+import asyncio
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro(loop))
+    finally:
+        loop.close()
+
+
+async def fifo_test(loop):
+    # waiters get tokens in the order they asked
+    bucket = TokenBucket(50, 1, loop)
+    order = []
+
+    async def acquire(i):
+        await bucket.acquire()
+        order.append(i)
+
+    tasks = []
+    for i in range(10):
+        tasks.append(loop.create_task(acquire(i)))
+        await asyncio.sleep(0)
+    await asyncio.wait(tasks)
+    assert order == list(range(10)), order
+
+
+async def cancel_test(loop):
+    # a cancelled waiter does not take a token, nor block the next one
+    bucket = TokenBucket(20, 1, loop)
+    await bucket.acquire()
+    first = loop.create_task(bucket.acquire())
+    second = loop.create_task(bucket.acquire())
+    await asyncio.sleep(0)
+    first.cancel()
+    t0 = loop.time()
+    await second
+    assert loop.time() - t0 < 0.09
+
+
+async def refill_test(loop):
+    # the burst is the capacity, then tokens come at rate per second, not once per second
+    bucket = TokenBucket(20, 5, loop)
+    t0 = loop.time()
+    times = []
+    for _ in range(15):
+        await bucket.acquire()
+        times.append(loop.time() - t0)
+    assert all(t < 0.02 for t in times[:5]), times
+    # the 10 tokens after the burst take 10 / 20 seconds, evenly
+    assert 0.45 <= times[-1] < 0.65, times
+    gaps = [b - a for a, b in zip(times[5:], times[6:])]
+    assert all(0.03 <= gap < 0.08 for gap in gaps), gaps
+
+    # tokens are refilled up to the capacity only
+    await asyncio.sleep(0.5)
+    assert bucket.tokens == 5
+
+
+if __name__ == '__main__':
+    for test in (fifo_test, cancel_test, refill_test):
+        run(test)
+        print(test.__name__, 'ok')